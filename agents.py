@@ -0,0 +1,78 @@
+import random
+from typing import Union
+
+from main import Game, Position, ZOBRIST_BLACK_TO_MOVE
+from search import Searcher, material_evaluation
+from transposition import TranspositionTable
+
+# an agent is any callable taking a position and the side to move and
+# returning a packed legal move
+
+class RandomAgent:
+    def __init__(self, seed : Union[int, None] = None):
+        self.random = random.Random(seed)
+
+    def __call__(self, position : Position, black_to_move : bool) -> int:
+        return self.random.choice(Game.generate_legal_moves(position, black_to_move))
+
+class SearchAgent:
+    # last_result keeps the SearchResult of the latest move for labelling, and
+    # is None when the move came from the opening book or the tablebases
+    def __init__(self, depth : int = 64, node_limit : Union[int, None] = None, time_limit : Union[float, None] = None,
+            evaluate = material_evaluation, table_size : int = 1 << 16, use_book : bool = True):
+        self.depth = depth
+        self.use_book = use_book
+        self.node_limit = node_limit
+        self.time_limit = time_limit
+        self.searcher = Searcher(evaluate, TranspositionTable(table_size))
+        self.last_result = None
+
+    def __call__(self, position : Position, black_to_move : bool) -> int:
+        if position.black_to_move != black_to_move:
+            position = position.copy()
+            position.black_to_move = black_to_move
+            position.key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.use_book:
+            move = Game.book_move(position)
+            if move:
+                self.last_result = None
+                return move
+        move = Game.tablebase_move(position)
+        if move:
+            self.last_result = None
+            return move
+        self.last_result = self.searcher.search(position, self.depth, self.time_limit, self.node_limit)
+        return self.last_result.best_move
+
+# evaluations a search agent can be given by name in its spec
+def find_evaluation(name : str):
+    if name == "material":
+        return material_evaluation
+    if name == "pst":
+        from evaluation import pst_evaluation
+        return pst_evaluation
+    raise ValueError(f"Unknown evaluation {name}.")
+
+# builds an agent from a short spec so that agents can be named on the command
+# line and sent to worker processes: "random", "search:DEPTH",
+# "search:nodes=N" or "search:time=SECONDS", where search options can be
+# combined with commas and include eval=material or eval=pst, eg "search:3,eval=pst"
+def make_agent(spec : str, seed : Union[int, None] = None):
+    name, _, options = spec.partition(":")
+    if name == "random":
+        return RandomAgent(seed)
+    if name == "search":
+        settings = dict()
+        for option in options.split(",") if options else ():
+            if option.startswith("nodes="):
+                settings["node_limit"] = int(option[len("nodes="):])
+            elif option.startswith("time="):
+                settings["time_limit"] = float(option[len("time="):])
+            elif option.startswith("eval="):
+                settings["evaluate"] = find_evaluation(option[len("eval="):])
+            else:
+                settings["depth"] = int(option)
+        if not settings.keys() & { "depth", "node_limit", "time_limit" }:
+            settings["depth"] = 2
+        return SearchAgent(**settings)
+    raise ValueError(f"Unknown agent {spec}.")
@@ -0,0 +1,166 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterable, Sequence, Union
+
+from main import move_to_string, string_to_move
+
+# append only log of a live game, one move per line
+# every move is flushed and synced as it's written, so a crash loses at most
+# the move being written; a torn last line is dropped when reading
+class MoveLog:
+    def __init__(self, path : str, sync : bool = True):
+        self.path = path
+        self.sync = sync
+        self.file = open(path, "w")
+        self.count = 0
+
+    # moves are packed moves, written out as strings like "E2 E4"
+    def append(self, move : int):
+        self.file.write(move_to_string(move) + "\n")
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        self.count += 1
+
+    # brings the log in line with a game's move list, appending new moves and
+    # only rewriting the file when the game has been restarted
+    def update(self, moves : Sequence[int]):
+        if len(moves) < self.count:
+            self.file.seek(0)
+            self.file.truncate()
+            self.count = 0
+        for move in moves[self.count:]:
+            self.append(move)
+
+    def close(self):
+        self.file.close()
+
+    @classmethod
+    def read(cls, path : str) -> list[str]:
+        with open(path, "r") as f:
+            text = f.read()
+        lines = text.split("\n")
+        # the last entry is either empty or a move that was only partly written
+        return [line for line in lines[:-1] if line]
+
+# binary archive of many games
+# file header: magic, version, game count and the offset of the index
+# each game: a header with its result and ply count, then one packed 16 bit
+# move per ply; the index at the end holds the offset of every game header
+# all numbers are little endian
+ARCHIVE_MAGIC = b"PYCA"
+ARCHIVE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sHHQQ")
+GAME_HEADER = struct.Struct("<BBHI")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+def is_archive(path : str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+class ArchiveWriter:
+    def __init__(self, path : str):
+        self.file = open(path, "wb")
+        self.offsets = array('Q')
+        # the header is filled in on close, once the index has been written
+        self.file.write(FILE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, 0, 0))
+
+    # moves are packed moves or move strings; returns the game's index
+    def add_game(self, moves : Iterable[Union[int, str]], result : str = "*") -> int:
+        packed = array('H', (string_to_move(move) if isinstance(move, str) else move for move in moves))
+        if sys.byteorder != "little":
+            packed.byteswap()
+        self.offsets.append(self.file.tell())
+        self.file.write(GAME_HEADER.pack(RESULTS.index(result), 0, 0, len(packed)))
+        packed.tofile(self.file)
+        return len(self.offsets) - 1
+
+    def close(self):
+        index_offset = self.file.tell()
+        offsets = array('Q', self.offsets)
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        offsets.tofile(self.file)
+        self.file.seek(0)
+        self.file.write(FILE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, len(self.offsets), index_offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# reads an archive through mmap, so only the games that are touched get paged in
+# moves are returned as memoryviews over the mapping, which must be released
+# before the archive is closed
+class GameArchive:
+    def __init__(self, path : str):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, index_offset = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            raise ValueError(f"{path} is not a game archive.")
+        self.count = count
+        self.view = memoryview(self.map)
+        self.index = self.typed(index_offset, count, 'Q')
+
+    # a view of count items at offset, copied only on big endian machines
+    def typed(self, offset : int, count : int, typecode : str):
+        view = self.view[offset:offset + count * array(typecode).itemsize].cast(typecode)
+        if sys.byteorder != "little":
+            view = array(typecode, view)
+            view.byteswap()
+        return view
+
+    def __len__(self) -> int:
+        return self.count
+
+    def result(self, game : int) -> str:
+        return RESULTS[GAME_HEADER.unpack_from(self.map, self.index[game])[0]]
+
+    def moves(self, game : int):
+        offset = self.index[game]
+        plies = GAME_HEADER.unpack_from(self.map, offset)[3]
+        return self.typed(offset + GAME_HEADER.size, plies, 'H')
+
+    # yields (result, moves) for every game in order
+    def iter_games(self):
+        for game in range(self.count):
+            yield self.result(game), self.moves(game)
+
+    def close(self):
+        if isinstance(self.index, memoryview):
+            self.index.release()
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack stored games into a binary game archive.")
+    parser.add_argument('out', help="Archive to write.")
+    parser.add_argument('inputs', nargs="+", help="JSON lines, --store files, move logs or other archives.")
+    args = parser.parse_args()
+
+    from replay import iter_records
+    with ArchiveWriter(args.out) as writer:
+        for record in iter_records(args.inputs):
+            if "error" in record:
+                print(f"Skipped {record['error']}")
+                continue
+            writer.add_game(record["moves"], record.get("result", "*"))
+        count = len(writer.offsets)
+    print(f"Wrote {count} games to {args.out} ({os.path.getsize(args.out)} bytes).")
+
+if __name__ == "__main__":
+    main()
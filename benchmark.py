@@ -0,0 +1,226 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import tracemalloc
+from time import perf_counter
+from typing import Union
+
+from main import Game, Position, PositionRenderer, MoveMaker, CheckChecker, BLACK_BIT, Piece
+from perft import PERFT_SUITE
+from replay import iter_games, replay_game
+
+BASELINE_VERSION = 1
+# differences smaller than these are noise, whatever the relative change
+NOISE_FLOORS = { "ns_per_op": 50.0, "peak_bytes": 4096, "temporary_bytes_per_op": 32.0, "blocks_per_op": 0.5, "bytes_per_op": 64.0 }
+TIME_METRICS = ("ns_per_op",)
+MEMORY_METRICS = ("peak_bytes", "temporary_bytes_per_op", "blocks_per_op", "bytes_per_op")
+# timed passes go over the ops as many times as it takes to run this long, so
+# that short benchmarks aren't at the mercy of a single scheduler hiccup
+MIN_PASS_TIME = 0.1
+# iterations of the calibration loop, timed alongside the benchmarks so that
+# times can be compared across machines and load in units of it
+CALIBRATION_LOOPS = 200000
+
+# the fixed corpus: the perft suite positions, plus every position reached
+# while playing through the move list fixtures in tests/
+def load_corpus(fixtures : str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests")) -> list[Position]:
+    positions = [Position.from_fen(fen) for fen, _ in PERFT_SUITE.values()]
+    game = Game(verbose=False)
+    for moves in iter_games(sorted(glob.glob(os.path.join(fixtures, "*.json")))):
+        positions.extend(replay_game(game, moves, per_ply=True))
+    return positions
+
+# every benchmark is built from the corpus into a list of argument tuples, one
+# per operation, and a function that performs one operation
+def check_move_ops(corpus : list[Position]) -> list[tuple]:
+    ops = []
+    for position in corpus:
+        black_to_move = position.black_to_move
+        for square, code in enumerate(position.squares):
+            if code and bool(code & BLACK_BIT) == black_to_move:
+                for move in MoveMaker.make_possible_moves(position, Piece.from_code(code, square)):
+                    ops.append((position, square, (move >> 6) & 63, black_to_move))
+    return ops
+
+def legal_move_ops(corpus : list[Position]) -> list[tuple]:
+    return [(position, move, Game.always_promote_queen) for position in corpus
+        for move in Game.generate_legal_moves(position, position.black_to_move)]
+
+renderer = PositionRenderer()
+
+BENCHMARKS = {
+    "Game.check_move": (check_move_ops, Game.check_move),
+    "CheckChecker.check_check": (lambda corpus: [(position,) for position in corpus], CheckChecker.check_check),
+    "Game.new_position_from_move": (legal_move_ops, Game.new_position_from_move),
+    "Game.generate_next_positions": (lambda corpus: [(position, position.black_to_move) for position in corpus],
+        Game.generate_next_positions),
+    "PositionRenderer.render": (lambda corpus: [(position,) for position in corpus], renderer.render),
+}
+
+# calls func over every op, keeping the results alive as the traced pass does
+def run_pass(func, ops : list[tuple]) -> list:
+    return [func(*args) for args in ops]
+
+def measure(func, ops : list[tuple], repeat : int = 5) -> dict:
+    # best of several untraced passes for the time
+    started = perf_counter()
+    run_pass(func, ops)
+    rounds = max(1, int(MIN_PASS_TIME / max(perf_counter() - started, 1e-9)) + 1)
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        for _ in range(rounds):
+            run_pass(func, ops)
+        elapsed = (perf_counter() - started) / rounds
+        best = elapsed if best is None else min(best, elapsed)
+    # then one traced pass: the peak of each op covers memory it only uses
+    # for a moment, the snapshot difference what's still held by the results
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    peak = 0
+    temporary = 0
+    results = []
+    for args in ops:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        results.append(func(*args))
+        op_peak = tracemalloc.get_traced_memory()[1]
+        temporary += op_peak - current
+        peak = max(peak, op_peak - start_bytes)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "lineno")
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    del results
+    count = max(len(ops), 1)
+    return {
+        "ops": len(ops),
+        "ns_per_op": best / count * 1e9,
+        "peak_bytes": peak,
+        "temporary_bytes_per_op": temporary / count,
+        "blocks_per_op": blocks / count,
+        "bytes_per_op": size / count,
+    }
+
+# a fixed pure python workload, best time per iteration in ns
+# ns_per_op over this is what gets compared against the baseline
+def calibrate(repeat : int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        table = dict()
+        for i in range(CALIBRATION_LOOPS):
+            table[i & 255] = (i * 31) ^ (i >> 3)
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / CALIBRATION_LOOPS * 1e9
+
+def run_benchmarks(names : Union[list[str], None] = None, repeat : int = 5) -> dict:
+    corpus = load_corpus()
+    results = dict()
+    for name, (build_ops, func) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        results[name] = measure(func, build_ops(corpus), repeat)
+    return results
+
+# the metrics that got worse than the baseline by more than the threshold,
+# as (benchmark, metric, baseline, current) tuples
+# baseline times are scaled by speed, the ratio of this run's calibration time
+# to the baseline's, so that a slower or busier machine isn't a regression
+def find_regressions(baseline : dict, results : dict, threshold : float = 0.25, memory_threshold : float = 0.1,
+        speed : float = 1.0) -> list[tuple]:
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in TIME_METRICS + MEMORY_METRICS:
+            if metric not in base:
+                continue
+            allowed = threshold if metric in TIME_METRICS else memory_threshold
+            current, previous = metrics[metric], base[metric]
+            if metric in TIME_METRICS:
+                previous *= speed
+            if current > previous * (1 + allowed) and current - previous > NOISE_FLOORS[metric]:
+                regressions.append((name, metric, previous, current))
+    return regressions
+
+def load_baseline(path : str) -> Union[dict, None]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != BASELINE_VERSION:
+        raise ValueError(f"{path} is not a version {BASELINE_VERSION} benchmark baseline.")
+    return data
+
+def save_baseline(path : str, results : dict, generator : str, calibration_ns : float):
+    data = {
+        "version": BASELINE_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "generator": generator,
+        "calibration_ns": calibration_ns,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the hot paths on a fixed corpus and compare against stored baselines.")
+    parser.add_argument('--baseline', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json"),
+        help="Baseline JSON file to compare against or update, defaults to the one committed next to this script.")
+    parser.add_argument('--update', action="store_true", help="Write the results as the new baseline instead of comparing.")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed relative slowdown, after calibration, before a time regression.")
+    parser.add_argument('--memory-threshold', type=float, default=0.1, help="Allowed relative growth in memory and allocations before failing.")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed passes per benchmark, the best one counts.")
+    parser.add_argument('--only', nargs="+", metavar="NAME", choices=list(BENCHMARKS), help="Run only these benchmarks.")
+    parser.add_argument('--generator', choices=["checker", "bitboard"], default="checker", help="Move generation backend.")
+    parser.add_argument('--gate-time', action="store_true",
+        help="Fail on time regressions too. By default they are only reported and the gate is on memory and allocations.")
+    parser.add_argument('--allow-missing', action="store_true", help="Pass instead of failing when there is no baseline file.")
+    args = parser.parse_args()
+
+    Game.set_move_generator(args.generator)
+    calibration_ns = calibrate(args.repeat)
+    results = run_benchmarks(args.only, args.repeat)
+    print(f"calibration: {calibration_ns:.1f} ns per loop")
+    print(f"{'benchmark':<30} {'ops':>7} {'ns/op':>10} {'peak KiB':>9} {'temp B/op':>10} {'blocks/op':>10} {'bytes/op':>9}")
+    for name, metrics in results.items():
+        print(f"{name:<30} {metrics['ops']:>7} {metrics['ns_per_op']:>10.0f} {metrics['peak_bytes'] / 1024:>9.1f}"
+            f" {metrics['temporary_bytes_per_op']:>10.0f} {metrics['blocks_per_op']:>10.2f} {metrics['bytes_per_op']:>9.0f}")
+
+    if args.update:
+        save_baseline(args.baseline, results, args.generator, calibration_ns)
+        print(f"Baseline written to {args.baseline}")
+        return
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --update to create one.")
+        if args.allow_missing:
+            return
+        sys.exit(1)
+    if baseline.get("generator") != args.generator:
+        print(f"Baseline was recorded with the {baseline.get('generator')} generator, not {args.generator}.")
+        sys.exit(1)
+    # baselines without a calibration time are compared as they are
+    speed = calibration_ns / baseline["calibration_ns"] if baseline.get("calibration_ns") else 1.0
+    regressions = find_regressions(baseline["results"], results, args.threshold, args.memory_threshold, speed)
+    failed = False
+    for name, metric, previous, current in regressions:
+        gated = args.gate_time or metric not in TIME_METRICS
+        failed = failed or gated
+        label = "REGRESSION" if gated else "slower (advisory)"
+        print(f"{label} {name} {metric}: {previous:.2f} -> {current:.2f} ({(current / previous - 1) * 100 if previous else 100:+.0f}%)")
+    if failed:
+        sys.exit(1)
+    print("No regressions against the baseline." if not regressions else "No memory regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
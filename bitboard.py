@@ -0,0 +1,254 @@
+from array import array
+
+from main import PIECE_ID, BLACK_BIT, KIND_MASK, MOVED_BIT, PROMOTION_CHOICES, Position, pack_move
+
+# bit n of a bitboard is the square with index n (rank * 8 + file), so A1 is
+# bit 0 and H8 is bit 63
+def build_leaper_table(offsets : list[tuple[int, int]]) -> list[int]:
+    table = []
+    for square in range(64):
+        rank, file = square >> 3, square & 7
+        attacks = 0
+        for rank_offset, file_offset in offsets:
+            to_rank, to_file = rank + rank_offset, file + file_offset
+            if 0 <= to_rank < 8 and 0 <= to_file < 8:
+                attacks |= 1 << (to_rank * 8 + to_file)
+        table.append(attacks)
+    return table
+
+KNIGHT_ATTACKS = build_leaper_table([ (1,2), (2,1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-2, -1), (-1, -2) ])
+KING_ATTACKS = build_leaper_table([ (1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1) ])
+# indexed by colour (0 white, 1 black) then square
+PAWN_ATTACKS = (
+    build_leaper_table([ (1, 1), (1, -1) ]),
+    build_leaper_table([ (-1, 1), (-1, -1) ])
+)
+
+# ray directions as (rank step, file step); the first four increase the square
+# index and the last four decrease it, which decides how we find the blocker
+DIRECTIONS = [ (1, 0), (0, 1), (1, 1), (1, -1), (-1, 0), (0, -1), (-1, -1), (-1, 1) ]
+
+def build_ray_table(rank_step : int, file_step : int) -> list[int]:
+    table = []
+    for square in range(64):
+        rank, file = (square >> 3) + rank_step, (square & 7) + file_step
+        ray = 0
+        while 0 <= rank < 8 and 0 <= file < 8:
+            ray |= 1 << (rank * 8 + file)
+            rank += rank_step
+            file += file_step
+        table.append(ray)
+    return table
+
+RAYS = [build_ray_table(rank_step, file_step) for rank_step, file_step in DIRECTIONS]
+
+# BETWEEN[a][b] holds the squares strictly between two squares on a shared
+# rank, file or diagonal, and is empty otherwise
+BETWEEN = [[0] * 64 for _ in range(64)]
+for start in range(64):
+    for rank_step, file_step in DIRECTIONS:
+        rank, file = (start >> 3) + rank_step, (start & 7) + file_step
+        between = 0
+        while 0 <= rank < 8 and 0 <= file < 8:
+            square = rank * 8 + file
+            BETWEEN[start][square] = between
+            between |= 1 << square
+            rank += rank_step
+            file += file_step
+
+def ray_attacks(direction : int, square : int, occupied : int) -> int:
+    ray = RAYS[direction][square]
+    blockers = ray & occupied
+    if blockers:
+        if direction < 4:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        # everything beyond the first blocker is shadowed
+        ray ^= RAYS[direction][blocker]
+    return ray
+
+def rook_attacks(square : int, occupied : int) -> int:
+    return (ray_attacks(0, square, occupied) | ray_attacks(1, square, occupied)
+        | ray_attacks(4, square, occupied) | ray_attacks(5, square, occupied))
+
+def bishop_attacks(square : int, occupied : int) -> int:
+    return (ray_attacks(2, square, occupied) | ray_attacks(3, square, occupied)
+        | ray_attacks(6, square, occupied) | ray_attacks(7, square, occupied))
+
+def iter_squares(bitboard : int):
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+# castling squares for each colour: king start, kingside and queenside
+# (king end, rook start, squares that must be empty, squares that must not be attacked)
+CASTLING = (
+    (4, ((6, 7, 0x60, (5, 6)), (2, 0, 0x0E, (3, 2)))),
+    (60, ((62, 63, 0x60 << 56, (61, 62)), (58, 56, 0x0E << 56, (59, 58))))
+)
+
+class Bitboards:
+    __slots__ = ("pieces", "colours", "occupied", "unmoved")
+
+    # pieces[colour][piece_id] holds one bitboard per piece type and colour
+    def __init__(self, position : Position):
+        self.pieces = ([0] * 6, [0] * 6)
+        self.colours = [0, 0]
+        self.unmoved = 0
+        for square, code in enumerate(position.squares):
+            if not code:
+                continue
+            colour = (code & BLACK_BIT) >> 3
+            bit = 1 << square
+            self.pieces[colour][(code & KIND_MASK) - 1] |= bit
+            self.colours[colour] |= bit
+            if not code & MOVED_BIT:
+                self.unmoved |= bit
+        self.occupied = self.colours[0] | self.colours[1]
+
+    # whether colour attacks square given an occupancy, ignoring any of its
+    # pieces on the squares in removed (ie pieces that have just been captured)
+    def is_attacked(self, square : int, colour : int, occupied : int, removed : int = 0) -> bool:
+        enemy = self.pieces[colour]
+        keep = ~removed
+        if KNIGHT_ATTACKS[square] & enemy[PIECE_ID.knight] & keep:
+            return True
+        # a pawn of the defending colour on square attacks exactly the squares
+        # that enemy pawns would attack it from
+        if PAWN_ATTACKS[colour ^ 1][square] & enemy[PIECE_ID.pawn] & keep:
+            return True
+        if KING_ATTACKS[square] & enemy[PIECE_ID.king]:
+            return True
+        queens = enemy[PIECE_ID.queen]
+        if bishop_attacks(square, occupied) & (enemy[PIECE_ID.bishop] | queens) & keep:
+            return True
+        if rook_attacks(square, occupied) & (enemy[PIECE_ID.rook] | queens) & keep:
+            return True
+        return False
+
+    # every enemy piece attacking square
+    def attackers(self, square : int, colour : int, occupied : int) -> int:
+        enemy = self.pieces[colour]
+        queens = enemy[PIECE_ID.queen]
+        return ((KNIGHT_ATTACKS[square] & enemy[PIECE_ID.knight])
+            | (PAWN_ATTACKS[colour ^ 1][square] & enemy[PIECE_ID.pawn])
+            | (KING_ATTACKS[square] & enemy[PIECE_ID.king])
+            | (bishop_attacks(square, occupied) & (enemy[PIECE_ID.bishop] | queens))
+            | (rook_attacks(square, occupied) & (enemy[PIECE_ID.rook] | queens)))
+
+    # every square attacked by colour given an occupancy
+    def attack_map(self, colour : int, occupied : int) -> int:
+        enemy = self.pieces[colour]
+        attacked = 0
+        pawns = enemy[PIECE_ID.pawn]
+        for square in iter_squares(pawns):
+            attacked |= PAWN_ATTACKS[colour][square]
+        for square in iter_squares(enemy[PIECE_ID.knight]):
+            attacked |= KNIGHT_ATTACKS[square]
+        for square in iter_squares(enemy[PIECE_ID.bishop] | enemy[PIECE_ID.queen]):
+            attacked |= bishop_attacks(square, occupied)
+        for square in iter_squares(enemy[PIECE_ID.rook] | enemy[PIECE_ID.queen]):
+            attacked |= rook_attacks(square, occupied)
+        return attacked | KING_ATTACKS[enemy[PIECE_ID.king].bit_length() - 1]
+
+class BitboardGenerator:
+
+    # returns every legal move for the side to move as packed 16 bit moves
+    @classmethod
+    def legal_moves(cls, position : Position, black_to_move : bool) -> array:
+        return array('H', cls.iter_legal_moves(position, black_to_move))
+
+    # yields legal moves one at a time, so callers can stop early
+    # checkers, pins and the squares the king can't step onto are computed once,
+    # after which only en passant needs playing out to test legality
+    @classmethod
+    def iter_legal_moves(cls, position : Position, black_to_move : bool):
+        boards = Bitboards(position)
+        us = 1 if black_to_move else 0
+        them = us ^ 1
+        own = boards.colours[us]
+        enemy = boards.colours[them]
+        occupied = boards.occupied
+        pieces = boards.pieces[us]
+        enemy_pieces = boards.pieces[them]
+        king = pieces[PIECE_ID.king].bit_length() - 1
+        king_bit = 1 << king
+
+        # sliders look through our king so that it can't retreat along their ray
+        danger = boards.attack_map(them, occupied ^ king_bit)
+        checkers = boards.attackers(king, them, occupied)
+        if not checkers:
+            targets = ~own
+        elif checkers & (checkers - 1):
+            # double check, only the king can move
+            targets = 0
+        else:
+            checker = checkers.bit_length() - 1
+            targets = checkers | BETWEEN[king][checker]
+
+        pins = dict()
+        queens = enemy_pieces[PIECE_ID.queen]
+        snipers = (rook_attacks(king, enemy) & (enemy_pieces[PIECE_ID.rook] | queens)) \
+            | (bishop_attacks(king, enemy) & (enemy_pieces[PIECE_ID.bishop] | queens))
+        for sniper in iter_squares(snipers):
+            blockers = BETWEEN[king][sniper] & occupied
+            if blockers & own and not blockers & (blockers - 1):
+                pins[blockers.bit_length() - 1] = BETWEEN[king][sniper] | 1 << sniper
+
+        for end in iter_squares(KING_ATTACKS[king] & ~own & ~danger):
+            yield pack_move(king, end)
+
+        if targets:
+            for start in iter_squares(pieces[PIECE_ID.knight]):
+                # a pinned knight can never stay on its pin ray
+                if start in pins:
+                    continue
+                for end in iter_squares(KNIGHT_ATTACKS[start] & targets):
+                    yield pack_move(start, end)
+            for start in iter_squares(pieces[PIECE_ID.bishop] | pieces[PIECE_ID.queen]):
+                for end in iter_squares(bishop_attacks(start, occupied) & targets & pins.get(start, -1)):
+                    yield pack_move(start, end)
+            for start in iter_squares(pieces[PIECE_ID.rook] | pieces[PIECE_ID.queen]):
+                for end in iter_squares(rook_attacks(start, occupied) & targets & pins.get(start, -1)):
+                    yield pack_move(start, end)
+
+        forward = -8 if us else 8
+        start_rank = 6 if us else 1
+        last_rank = 0 if us else 7
+        if targets:
+            for start in iter_squares(pieces[PIECE_ID.pawn]):
+                pawn_targets = PAWN_ATTACKS[us][start] & enemy
+                end = start + forward
+                if not occupied >> end & 1:
+                    pawn_targets |= 1 << end
+                    if start >> 3 == start_rank and not occupied >> (end + forward) & 1:
+                        pawn_targets |= 1 << (end + forward)
+                for end in iter_squares(pawn_targets & targets & pins.get(start, -1)):
+                    if end >> 3 == last_rank:
+                        for promotion in PROMOTION_CHOICES:
+                            yield pack_move(start, end, promotion)
+                    else:
+                        yield pack_move(start, end)
+
+        # en passant removes two pieces from a line, so test it by its result
+        ep_square = position.ep_square
+        if ep_square != -1 and enemy_pieces[PIECE_ID.pawn] >> (ep_square - forward) & 1:
+            captured_bit = 1 << (ep_square - forward)
+            for start in iter_squares(PAWN_ATTACKS[them][ep_square] & pieces[PIECE_ID.pawn]):
+                after = (occupied & ~(1 << start) & ~captured_bit) | 1 << ep_square
+                if not boards.is_attacked(king, them, after, captured_bit):
+                    yield pack_move(start, ep_square)
+
+        # castling rights follow the moved flags of the king and rook
+        king_start, sides = CASTLING[us]
+        if king == king_start and boards.unmoved & king_bit and not checkers:
+            for king_end, rook_start, between, crossed in sides:
+                if not (boards.unmoved & pieces[PIECE_ID.rook]) >> rook_start & 1:
+                    continue
+                if occupied & between:
+                    continue
+                if any(danger >> square & 1 for square in crossed):
+                    continue
+                yield pack_move(king, king_end)
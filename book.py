@@ -0,0 +1,149 @@
+import argparse
+import mmap
+import struct
+from time import perf_counter
+from typing import Iterable
+
+from main import Game, Position, move_to_string, string_to_move
+from replay import ReplayError, iter_records, replay_game
+
+# a book is a sorted array of fixed size entries, one per position and move:
+# zobrist key, packed move, then games, white wins, draws and black wins
+# entries are sorted by key then move, so every move from a position is
+# found with one binary search on the key
+BOOK_MAGIC = b"PYCB"
+BOOK_VERSION = 1
+BOOK_HEADER = struct.Struct("<4sHHQ")
+BOOK_ENTRY = struct.Struct("<QHHIIII")
+KEY = struct.Struct("<Q")
+RESULT_COLUMNS = { "1-0": 0, "1/2-1/2": 1, "0-1": 2 }
+
+class BookMove:
+    __slots__ = ("move", "games", "white", "draws", "black")
+
+    def __init__(self, move : int, games : int, white : int, draws : int, black : int):
+        self.move = move
+        self.games = games
+        self.white = white
+        self.draws = draws
+        self.black = black
+
+    # score for the side making the move, counting draws as half a win
+    def score(self, black_to_move : bool) -> float:
+        decided = self.white + self.draws + self.black
+        if decided == 0:
+            return 0.5
+        wins = self.black if black_to_move else self.white
+        return (wins + self.draws / 2) / decided
+
+# counts every move played in the first max_plies of each game
+# games with illegal moves are skipped, unless trusted turns validation off
+def build_book(paths : Iterable[str], out : str, max_plies : int = 24, min_games : int = 1, trusted : bool = False) -> int:
+    counts = dict()
+    game = Game(verbose=False)
+    start_key = game.current_position.key
+    for record in iter_records(paths):
+        if "error" in record:
+            continue
+        column = RESULT_COLUMNS.get(record.get("result"))
+        keys = [start_key]
+        try:
+            moves = [string_to_move(move) if isinstance(move, str) else move for move in record["moves"][:max_plies]]
+            for position in replay_game(game, moves, trusted, per_ply=True):
+                keys.append(position.key)
+        except (ValueError, ReplayError):
+            continue
+        for key, move in zip(keys, moves):
+            entry = counts.get((key, move))
+            if entry is None:
+                entry = counts[(key, move)] = [0, 0, 0, 0]
+            entry[0] += 1
+            if column is not None:
+                entry[column + 1] += 1
+
+    with open(out, "wb") as f:
+        f.write(BOOK_HEADER.pack(BOOK_MAGIC, BOOK_VERSION, 0, 0))
+        written = 0
+        for (key, move), entry in sorted(counts.items()):
+            if entry[0] < min_games:
+                continue
+            f.write(BOOK_ENTRY.pack(key, move, 0, *entry))
+            written += 1
+        f.seek(0)
+        f.write(BOOK_HEADER.pack(BOOK_MAGIC, BOOK_VERSION, 0, written))
+    return written
+
+# reads a book through mmap; nothing is loaded up front and every lookup is a
+# binary search touching a handful of pages
+class OpeningBook:
+    def __init__(self, path : str):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count = BOOK_HEADER.unpack_from(self.map, 0)
+        if magic != BOOK_MAGIC or version != BOOK_VERSION:
+            raise ValueError(f"{path} is not an opening book.")
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    # every book move from the position with this key, most played first
+    def lookup(self, key : int) -> list[BookMove]:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) >> 1
+            if KEY.unpack_from(self.map, BOOK_HEADER.size + middle * BOOK_ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        for index in range(low, self.count):
+            entry_key, move, _, games, white, draws, black = BOOK_ENTRY.unpack_from(self.map, BOOK_HEADER.size + index * BOOK_ENTRY.size)
+            if entry_key != key:
+                break
+            moves.append(BookMove(move, games, white, draws, black))
+        moves.sort(key=lambda book_move: book_move.games, reverse=True)
+        return moves
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query an opening book.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build a book from stored games.")
+    build.add_argument('out', help="Book to write.")
+    build.add_argument('inputs', nargs="+", help="JSON lines, --store files, move logs or game archives.")
+    build.add_argument('--max-plies', type=int, default=24, help="Only count moves in the first plies of each game.")
+    build.add_argument('--min-games', type=int, default=1, help="Drop moves played in fewer games.")
+    build.add_argument('--trusted', action="store_true", help="Skip legality checks when replaying.")
+    probe = commands.add_parser("probe", help="List the book moves from a position.")
+    probe.add_argument('book')
+    probe.add_argument('--fen', help="Position to look up, defaults to the start position.")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        started = perf_counter()
+        written = build_book(args.inputs, args.out, args.max_plies, args.min_games, args.trusted)
+        print(f"Wrote {written} entries to {args.out} in {perf_counter() - started:.2f}s.")
+        return
+
+    position = Position.from_fen(args.fen) if args.fen else Game.start_position()
+    with OpeningBook(args.book) as book:
+        started = perf_counter()
+        moves = book.lookup(position.key)
+        elapsed = perf_counter() - started
+        for book_move in moves:
+            print(f"{move_to_string(book_move.move)}: {book_move.games} games, +{book_move.white} ={book_move.draws} -{book_move.black}"
+                f" ({book_move.score(position.black_to_move) * 100:.0f}%)")
+        print(f"{len(moves)} moves found in {elapsed * 1e6:.0f}us.")
+
+if __name__ == "__main__":
+    main()
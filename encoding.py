@@ -0,0 +1,113 @@
+from typing import Iterable, Union
+
+import numpy as np
+
+from main import Position, PIECE_ID, MOVED_BIT, CASTLING_SQUARES, pack_piece
+
+# plane layout: 12 piece planes (white king, queen, rook, bishop, knight, pawn,
+# then the same for black), side to move, four castling planes in KQkq order,
+# the en passant square and the move count
+PIECE_PLANES = 12
+SIDE_PLANE = 12
+CASTLING_PLANE = 13
+EP_PLANE = 17
+MOVE_COUNT_PLANE = 18
+PLANES = 19
+
+# plane index for each packed piece code with its moved bit cleared, -1 if empty
+CODE_TO_PLANE = np.full(MOVED_BIT, -1, dtype=np.int8)
+# packed piece code for each piece plane
+PLANE_TO_CODE = np.zeros(PIECE_PLANES, dtype=np.uint8)
+for piece_id in PIECE_ID:
+    for is_black in (False, True):
+        plane = piece_id + (6 if is_black else 0)
+        CODE_TO_PLANE[pack_piece(piece_id, is_black)] = plane
+        PLANE_TO_CODE[plane] = pack_piece(piece_id, is_black)
+
+# king square, rook square and unmoved codes for each castling right
+CASTLING_CODES = [
+    (king, rook, pack_piece(PIECE_ID.king, right.islower()), pack_piece(PIECE_ID.rook, right.islower()))
+    for right, (king, rook) in CASTLING_SQUARES.items()
+]
+
+# encodes positions into out[:len(positions)], which may be a memmap or any
+# other caller owned array of shape (N, PLANES, 8, 8); planes are indexed
+# [rank][file] with rank 0 being the first rank
+# the move count plane holds each position's fullmove number unless
+# move_counts gives other values, one per position
+def encode_positions(positions : list[Position], out : Union[np.ndarray, None] = None, dtype = np.float32,
+        move_counts : Union[Iterable[int], None] = None) -> np.ndarray:
+    count = len(positions)
+    if out is None:
+        out = np.zeros((count, PLANES, 8, 8), dtype=dtype)
+    elif out.shape[1:] != (PLANES, 8, 8) or out.shape[0] < count:
+        raise ValueError(f"Output buffer must have shape (>= {count}, {PLANES}, 8, 8).")
+    else:
+        out[:count] = 0
+    # a view over the same memory with the squares flattened
+    flat = out[:count].reshape(count, PLANES, 64)
+    if not np.shares_memory(flat, out):
+        raise ValueError("Output buffer must be contiguous.")
+    if count == 0:
+        return out
+
+    boards = np.frombuffer(b"".join(position.squares for position in positions), dtype=np.uint8).reshape(count, 64)
+    planes = CODE_TO_PLANE[boards & (MOVED_BIT - 1)]
+    rows, squares = np.nonzero(planes >= 0)
+    flat[rows, planes[rows, squares], squares] = 1
+
+    black_to_move = np.fromiter((position.black_to_move for position in positions), dtype=bool, count=count)
+    flat[black_to_move, SIDE_PLANE] = 1
+
+    # castling rights follow the moved flags, so compare the full codes
+    for offset, (king, rook, king_code, rook_code) in enumerate(CASTLING_CODES):
+        rights = (boards[:, king] == king_code) & (boards[:, rook] == rook_code)
+        flat[rights, CASTLING_PLANE + offset] = 1
+
+    ep_squares = np.fromiter((position.ep_square for position in positions), dtype=np.int16, count=count)
+    ep_rows = np.nonzero(ep_squares >= 0)[0]
+    flat[ep_rows, EP_PLANE, ep_squares[ep_rows]] = 1
+
+    if move_counts is None:
+        move_counts = (position.fullmove_number for position in positions)
+    flat[:, MOVE_COUNT_PLANE] = np.fromiter(move_counts, dtype=out.dtype, count=count)[:, None]
+    return out
+
+# encodes a stream of positions into out in batches, returning how many
+# positions were written
+def encode_stream(positions : Iterable[Position], out : np.ndarray, batch_size : int = 4096) -> int:
+    written = 0
+    batch = []
+    for position in positions:
+        batch.append(position)
+        if len(batch) == batch_size:
+            encode_positions(batch, out[written:written + batch_size])
+            written += batch_size
+            batch = []
+    if batch:
+        encode_positions(batch, out[written:written + len(batch)])
+        written += len(batch)
+    return written
+
+# turns encoded planes back into positions; moved flags are rebuilt from the
+# castling planes the same way as for FEN, so positions round trip by key
+# and the fullmove number comes back from the move count plane
+def decode_positions(encoded : np.ndarray) -> list[Position]:
+    count = encoded.shape[0]
+    flat = np.ascontiguousarray(encoded).reshape(count, PLANES, 64)
+    pieces = flat[:, :PIECE_PLANES]
+    occupied = pieces.max(axis=1) > 0
+    codes = np.where(occupied, PLANE_TO_CODE[pieces.argmax(axis=1)], 0).astype(np.uint8)
+    black_to_move = flat[:, SIDE_PLANE, 0] > 0
+    rights = np.zeros(count, dtype=np.int64)
+    for offset in range(4):
+        rights |= (flat[:, CASTLING_PLANE + offset, 0] > 0).astype(np.int64) << offset
+    has_ep = flat[:, EP_PLANE].max(axis=1) > 0
+    ep_squares = np.where(has_ep, flat[:, EP_PLANE].argmax(axis=1), -1)
+    # zero for planes encoded before the move count was filled in
+    fullmove_numbers = np.maximum(flat[:, MOVE_COUNT_PLANE, 0], 1)
+    return [
+        Position.from_state(codes[row].tobytes(), bool(black_to_move[row]), int(rights[row]), int(ep_squares[row]),
+            fullmove_number=int(fullmove_numbers[row]))
+        for row in range(count)
+    ]
@@ -0,0 +1,140 @@
+import argparse
+import random
+from time import perf_counter
+from typing import Iterable, Union
+
+import numpy as np
+
+from main import (
+    Game, Position, PIECE_SCORES, MAX_PHASE, taper_score, unpack_score, position_score, unpack_move
+)
+from perft import START_FEN
+
+# the packed piece-square tables split back into arrays indexed by
+# [code & 0x0F, square], for scoring many boards at once
+MIDDLEGAME_TABLE = np.array([[unpack_score(score)[0] for score in row] for row in PIECE_SCORES], dtype=np.int32)
+ENDGAME_TABLE = np.array([[unpack_score(score)[1] for score in row] for row in PIECE_SCORES], dtype=np.int32)
+PHASE_TABLE = np.array([[unpack_score(score)[2] for score in row] for row in PIECE_SCORES], dtype=np.int32)
+SQUARE_COLUMNS = np.arange(64)
+
+# tapered material and piece-square score from white's point of view, read from
+# the score make_move keeps, so it costs the same whatever is on the board
+# a drop in evaluate for Searcher and SearchAgent
+def pst_evaluation(position : Position) -> int:
+    return taper_score(position.score)
+
+# the same score worked out from every square, to check the incremental one against
+def full_evaluation(position : Position) -> int:
+    return taper_score(position_score(position.squares))
+
+# stacks the boards of positions into an (n, 64) array of piece codes
+def squares_array(positions : Iterable[Position]) -> np.ndarray:
+    data = b"".join(bytes(position.squares) for position in positions)
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, 64)
+
+# scores every row of an (n, 64) array of piece codes, or a list of positions,
+# with table lookups; gives the same numbers as pst_evaluation
+def evaluate_batch(boards : Union[np.ndarray, Iterable[Position]]) -> np.ndarray:
+    if not isinstance(boards, np.ndarray):
+        boards = squares_array(boards)
+    codes = boards & 0x0F
+    middlegame = MIDDLEGAME_TABLE[codes, SQUARE_COLUMNS].sum(axis=1, dtype=np.int64)
+    endgame = ENDGAME_TABLE[codes, SQUARE_COLUMNS].sum(axis=1, dtype=np.int64)
+    phase = np.minimum(PHASE_TABLE[codes, SQUARE_COLUMNS].sum(axis=1, dtype=np.int64), MAX_PHASE)
+    # floor division, as in taper_score
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+
+# positions from random games, for checking and timing
+def sample_positions(games : int, max_plies : int = 200, seed : int = 0) -> list[Position]:
+    rng = random.Random(seed)
+    positions = []
+    for _ in range(games):
+        position = Position.from_fen(START_FEN)
+        for _ in range(max_plies):
+            moves = Game.generate_legal_moves(position, position.black_to_move)
+            if not len(moves):
+                break
+            start, end, promotion = unpack_move(rng.choice(moves))
+            position.make_move(start, end, promotion or 1)
+            positions.append(position.copy())
+    return positions
+
+# plays random games through make_move and unmake_move, checking the
+# incremental score against a full recount at every ply and the batch scores
+# against both; returns the number of mismatches
+def verify(games : int = 20, max_plies : int = 200, seed : int = 0) -> int:
+    rng = random.Random(seed)
+    mismatches = 0
+    positions = []
+    for _ in range(games):
+        position = Position.from_fen(START_FEN)
+        scores = [position.score]
+        for _ in range(max_plies):
+            moves = Game.generate_legal_moves(position, position.black_to_move)
+            if not len(moves):
+                break
+            start, end, promotion = unpack_move(rng.choice(moves))
+            position.make_move(start, end, promotion or 1)
+            scores.append(position.score)
+            if position.score != position_score(position.squares):
+                mismatches += 1
+            positions.append(position.copy())
+        # unwinding has to give back every score on the way
+        while position.undo:
+            scores.pop()
+            position.unmake_move()
+            if position.score != scores[-1]:
+                mismatches += 1
+    batch = evaluate_batch(positions)
+    mismatches += sum(1 for position, score in zip(positions, batch) if int(score) != pst_evaluation(position))
+    return mismatches
+
+# times pst_evaluation and full_evaluation on positions grouped by how many
+# pieces are left, plus the batch mode over all of them
+def benchmark(games : int = 20, repeat : int = 20000, seed : int = 0) -> dict:
+    positions = sample_positions(games, seed=seed)
+    groups = dict()
+    for position in positions:
+        count = 64 - position.squares.count(0)
+        groups.setdefault(count, position)
+    rows = []
+    for count in sorted(groups):
+        position = groups[count]
+        timings = dict()
+        for name, evaluate in (("incremental", pst_evaluation), ("full", full_evaluation)):
+            started = perf_counter()
+            for _ in range(repeat):
+                evaluate(position)
+            timings[name] = (perf_counter() - started) / repeat
+        rows.append({ "pieces": count, "incremental_ns": timings["incremental"] * 1e9, "full_ns": timings["full"] * 1e9 })
+    boards = squares_array(positions)
+    started = perf_counter()
+    evaluate_batch(boards)
+    batch_time = perf_counter() - started
+    return { "rows": rows, "batch_positions": len(positions), "batch_ns": batch_time / max(len(positions), 1) * 1e9 }
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the incremental piece-square evaluation.")
+    parser.add_argument('--generator', choices=["checker", "bitboard"], default="bitboard", help="Move generation backend.")
+    parser.add_argument('--games', type=int, default=20, help="Random games to sample positions from.")
+    parser.add_argument('--seed', type=int, default=0)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("verify", help="Check the incremental, full and batch scores agree.")
+    bench = commands.add_parser("bench", help="Time leaf evaluation by piece count.")
+    bench.add_argument('--repeat', type=int, default=20000, help="Evaluations timed per position.")
+    args = parser.parse_args()
+
+    Game.set_move_generator(args.generator)
+    if args.command == "verify":
+        mismatches = verify(args.games, seed=args.seed)
+        print("all scores agree" if not mismatches else f"{mismatches} mismatches")
+        raise SystemExit(1 if mismatches else 0)
+
+    stats = benchmark(args.games, args.repeat, args.seed)
+    print(f"{'pieces':>6} {'incremental ns':>15} {'full ns':>10}")
+    for row in stats["rows"]:
+        print(f"{row['pieces']:>6} {row['incremental_ns']:>15.0f} {row['full_ns']:>10.0f}")
+    print(f"batch: {stats['batch_ns']:.0f} ns per position over {stats['batch_positions']} positions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import sys
+from collections import defaultdict
+from time import perf_counter
+from typing import Union
+
+import main
+
+# the hot paths worth timing, by class (or None for module level functions)
+HOT_FUNCTIONS = {
+    "Game": ("check_move", "iter_legal_moves", "generate_legal_moves", "has_legal_move", "try_move", "apply_move", "book_move", "legal_moves"),
+    "PieceChecker": ("check_move", "check_castling", "check_obstacles"),
+    "MoveStrategyChecker": ("check_move",),
+    "CheckChecker": ("check_can_attack", "check_check"),
+    "LegalityChecker": ("__init__", "is_legal"),
+    "MoveMaker": ("make_possible_moves",),
+    "Position": ("__init__", "copy", "make_move", "unmake_move", "get_piece_positions", "from_fen", "to_fen"),
+    None: ("attacked_squares", "attackers", "is_attacked", "is_in_check", "zobrist_key"),
+}
+
+# counters derived from call counts: functions that create a position, and
+# functions that build a dict on every call; the checkers and MoveMaker
+# dispatch through class level tables, so they don't count
+COUNTERS = {
+    "positions created": ("Position.__init__", "Position.copy"),
+    "dicts built": ("Position.get_piece_positions",),
+}
+
+class Profiler:
+    def __init__(self):
+        self.calls = defaultdict(int)
+        # total includes time spent in wrapped callees, own doesn't
+        self.total = defaultdict(float)
+        self.own = defaultdict(float)
+        self.stacks = defaultdict(float)
+        self.messages = defaultdict(int)
+        self.stack = []
+        # time spent in wrapped callees of every open frame, plus a root frame
+        self.children = [0.0]
+        self.active = defaultdict(int)
+        self.started = perf_counter()
+
+    def wrap(self, name : str, func):
+        profiler = self
+        if inspect.isgeneratorfunction(func):
+            # time between yields belongs to the caller, so only count calls
+            @functools.wraps(func)
+            def counter(*args, **kwargs):
+                profiler.calls[name] += 1
+                return func(*args, **kwargs)
+            return counter
+
+        @functools.wraps(func)
+        def timer(*args, **kwargs):
+            stack = profiler.stack
+            stack.append(name)
+            profiler.children.append(0.0)
+            profiler.active[name] += 1
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - started
+                own = elapsed - profiler.children.pop()
+                profiler.children[-1] += elapsed
+                profiler.calls[name] += 1
+                profiler.own[name] += own
+                profiler.stacks[";".join(stack)] += own
+                # recursive calls are already inside the outermost one's total
+                profiler.active[name] -= 1
+                if profiler.active[name] == 0:
+                    profiler.total[name] += elapsed
+                stack.pop()
+        return timer
+
+    # replaces d_print, so that debug messages are counted by their template
+    def message(self, message : str, *args):
+        self.messages[message] += 1
+        if main.DEBUG:
+            print(message % args if args else message)
+
+    def report(self) -> dict:
+        functions = {
+            name: { "calls": calls, "total": self.total[name], "own": self.own[name] }
+            for name, calls in self.calls.items()
+        }
+        counters = { counter: sum(self.calls.get(name, 0) for name in names) for counter, names in COUNTERS.items() }
+        return {
+            "elapsed": perf_counter() - self.started,
+            "functions": functions,
+            "counters": counters,
+            "messages": dict(self.messages),
+        }
+
+    def print_report(self, file = sys.stderr):
+        report = self.report()
+        print(f"Profile over {report['elapsed']:.3f}s", file=file)
+        print(f"{'function':<40} {'calls':>10} {'total ms':>10} {'own ms':>10} {'us/call':>8}", file=file)
+        for name, stats in sorted(report["functions"].items(), key=lambda item: item[1]["own"], reverse=True):
+            per_call = stats["total"] / stats["calls"] * 1e6 if stats["calls"] else 0
+            print(f"{name:<40} {stats['calls']:>10} {stats['total'] * 1e3:>10.1f} {stats['own'] * 1e3:>10.1f} {per_call:>8.1f}", file=file)
+        for counter, count in report["counters"].items():
+            print(f"{counter}: {count}", file=file)
+        for message, count in sorted(report["messages"].items(), key=lambda item: item[1], reverse=True):
+            print(f"{count:>10} x {message}", file=file)
+
+    def write_json(self, path : str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    # one line per call stack with its own time in microseconds, the collapsed
+    # format read by flamegraph.pl and speedscope
+    def write_collapsed(self, path : str):
+        with open(path, "w") as f:
+            for stack, own in sorted(self.stacks.items()):
+                f.write(f"{stack} {round(own * 1e6)}\n")
+
+profiler = None
+
+# wraps the hot functions in main and returns the profiler recording them
+# nothing is wrapped until this is called, so there's no cost when disabled
+def enable() -> Profiler:
+    global profiler
+    if profiler is not None:
+        return profiler
+    profiler = Profiler()
+    for class_name, names in HOT_FUNCTIONS.items():
+        owner = getattr(main, class_name) if class_name else main
+        for name in names:
+            qualified = f"{class_name}.{name}" if class_name else name
+            attribute = owner.__dict__[name] if class_name else getattr(main, name)
+            if isinstance(attribute, classmethod):
+                setattr(owner, name, classmethod(profiler.wrap(qualified, attribute.__func__)))
+            else:
+                setattr(owner, name, profiler.wrap(qualified, attribute))
+    main.d_print = profiler.message
+    return profiler
+
+# enables profiling and reports when the process exits: printed to stderr, and
+# written as JSON and collapsed stacks when paths are given
+# "{pid}" in a path is replaced, so that worker processes don't overwrite each other
+def install(json_path : Union[str, None] = None, stacks_path : Union[str, None] = None, show : bool = True) -> Profiler:
+    enabled = enable()
+
+    def finish():
+        if show:
+            enabled.print_report()
+        if json_path:
+            enabled.write_json(json_path.replace("{pid}", str(os.getpid())))
+        if stacks_path:
+            enabled.write_collapsed(stacks_path.replace("{pid}", str(os.getpid())))
+    atexit.register(finish)
+    return enabled
+
+# PYCHESS_PROFILE=1 prints a report, any other value is the JSON path
+# PYCHESS_PROFILE_STACKS is the collapsed stacks path
+def install_from_env() -> Union[Profiler, None]:
+    setting = os.environ.get("PYCHESS_PROFILE")
+    if not setting:
+        return None
+    return install(None if setting == "1" else setting, os.environ.get("PYCHESS_PROFILE_STACKS"))
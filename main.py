@@ -1,13 +1,13 @@
 from enum import IntEnum, auto
-from copy import deepcopy
-from typing import Union
-from os import system
+from array import array
+from typing import Iterable, Union
+from os import system, environ
 from time import sleep
-import json
 import argparse
 import io
+import random
 
-DEBUG = False
+DEBUG = bool(environ.get("PYCHESS_DEBUG"))
 
 class PIECE_ID(IntEnum):
     king = 0
@@ -30,9 +30,11 @@ piece_info = {
     PIECE_ID.pawn: "Pawn"
 }
 
-def d_print(string):
+# arguments are only formatted into the message when it's printed
+# instrument.enable swaps this out to count messages instead
+def d_print(message : str, *args):
     if DEBUG:
-        print(string)
+        print(message % args if args else message)
 
 def get_unicode_char(piece_id : PIECE_ID, isBlack : bool, darkmode : bool = False):
     modifier = 0
@@ -57,21 +59,182 @@ def coord_to_position(rank : int, file : int) -> str:
 def position_to_coord(position : str):
     return (letter_to_file(position[0]), int(position[1]) - 1)
 
-def find_rook_position(is_black, end_position):
-    # black kingside
-    if is_black and end_position == "G8":
-        return "H8"
-    # black queenside
-    elif is_black and end_position == "C8":
-        return "A8"
-    # white kingside
-    elif not is_black and end_position == "G1":
-        return "H1"
-    # white queenside
-    elif not is_black and end_position == "C1":
-        return "A1"
+# pieces are stored in the board as packed one byte codes
+# bits 0-2 hold the piece id + 1 (so that 0 is an empty square), bit 3 is set
+# for black pieces and bit 4 once the piece has moved
+EMPTY = 0
+KIND_MASK = 0x07
+BLACK_BIT = 0x08
+MOVED_BIT = 0x10
+
+# squares are indexed 0-63 as rank * 8 + file, so A1 is 0 and H8 is 63
+def square_index(rank : int, file : int) -> int:
+    return rank * 8 + file
+
+SQUARE_NAMES = [coord_to_position(sq >> 3, sq & 7) for sq in range(64)]
+SQUARE_INDEX = {name: sq for sq, name in enumerate(SQUARE_NAMES)}
+
+# each make_move pushes one fixed size undo record onto the position's undo stack:
+# start, end, moved piece's original code, captured square, captured code,
+# rook start, rook code and the previous en passant square
+UNDO_SIZE = 9
+
+# piece letters as used by FEN, indexed by PIECE_ID
+PIECE_LETTERS = "KQRBNP"
+PROMOTION_CHOICES = (PIECE_ID.queen, PIECE_ID.rook, PIECE_ID.bishop, PIECE_ID.knight)
+# king and rook start squares for each FEN castling right
+CASTLING_SQUARES = { "K": (4, 7), "Q": (4, 0), "k": (60, 63), "q": (60, 56) }
+# castling rights can only change when one of these squares is moved from or to
+CASTLING_CORNERS = frozenset((0, 4, 7, 56, 60, 63))
+
+# zobrist keys: one random 64 bit number per (piece code, square), for the side
+# to move, each combination of castling rights and each en passant file
+# piece keys are indexed by the code without its moved bit
+zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = [[zobrist_random.getrandbits(64) for _ in range(64)] for _ in range(16)]
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [zobrist_random.getrandbits(64) for _ in range(16)]
+ZOBRIST_EP = [zobrist_random.getrandbits(64) for _ in range(8)]
+
+def pack_piece(piece_id : PIECE_ID, is_black : bool, moved : bool = False) -> int:
+    return (piece_id + 1) | (BLACK_BIT if is_black else 0) | (MOVED_BIT if moved else 0)
+
+# moves pack into 16 bits: start square in bits 0-5, end square in bits 6-11
+# and the promotion piece id in bits 12-14 (ignored unless a pawn promotes)
+def pack_move(start : int, end : int, promotion : int = 0) -> int:
+    return start | (end << 6) | (promotion << 12)
+
+def unpack_move(move : int) -> tuple[int, int, int]:
+    return (move & 63, (move >> 6) & 63, move >> 12)
+
+# moves are written as "E2 E4", with the promotion piece letter appended for
+# promotions, eg "E7 E8 Q"
+def move_to_string(move : int) -> str:
+    text = f"{SQUARE_NAMES[move & 63]} {SQUARE_NAMES[(move >> 6) & 63]}"
+    if move >> 12:
+        text += f" {PIECE_LETTERS[move >> 12]}"
+    return text
+
+def string_to_move(text : str) -> int:
+    parts = text.upper().split()
+    if len(parts) not in (2, 3) or parts[0] not in SQUARE_INDEX or parts[1] not in SQUARE_INDEX:
+        raise ValueError(f"Invalid move {text}.")
+    promotion = 0
+    if len(parts) == 3:
+        if parts[2] not in PIECE_LETTERS[1:5]:
+            raise ValueError(f"Invalid promotion piece {parts[2]}.")
+        promotion = PIECE_LETTERS.index(parts[2])
+    return pack_move(SQUARE_INDEX[parts[0]], SQUARE_INDEX[parts[1]], promotion)
+
+# castling rights as a 4 bit mask in KQkq order, derived from moved flags
+def castling_rights(squares : bytearray) -> int:
+    rights = 0
+    for bit, (right, (king, rook)) in enumerate(CASTLING_SQUARES.items()):
+        if squares[king] == pack_piece(PIECE_ID.king, right.islower()) and squares[rook] == pack_piece(PIECE_ID.rook, right.islower()):
+            rights |= 1 << bit
+    return rights
+
+# the en passant square only counts towards the key when a pawn could
+# actually capture onto it, so transposed move orders share a key
+def ep_capturable(squares : bytearray, ep_square : int) -> bool:
+    if ep_square == -1:
+        return False
+    # white pawns skip rank 3 and black pawns skip rank 6
+    pawn_square = ep_square + 8 if ep_square >> 3 == 2 else ep_square - 8
+    capturer = pack_piece(PIECE_ID.pawn, ep_square >> 3 == 2)
+    file = pawn_square & 7
+    return (file > 0 and squares[pawn_square - 1] & ~MOVED_BIT == capturer) or \
+        (file < 7 and squares[pawn_square + 1] & ~MOVED_BIT == capturer)
+
+def zobrist_key(squares : bytearray, black_to_move : bool, ep_square : int) -> int:
+    key = ZOBRIST_CASTLING[castling_rights(squares)]
+    for square, code in enumerate(squares):
+        if code:
+            key ^= ZOBRIST_PIECES[code & 0x0F][square]
+    if black_to_move:
+        key ^= ZOBRIST_BLACK_TO_MOVE
+    if ep_capturable(squares, ep_square):
+        key ^= ZOBRIST_EP[ep_square & 7]
+    return key
+
+# piece-square scores: material plus a bonus for where each piece stands, for
+# the middlegame and the endgame, and a game phase weight per piece
+# a score packs all three into one int (see pack_score) so that make_move keeps
+# it up to date with one addition per changed square, like the zobrist key
+# values are by PIECE_ID and from white's point of view
+MIDDLEGAME_VALUES = (0, 1025, 477, 365, 337, 82)
+ENDGAME_VALUES = (0, 936, 512, 297, 281, 94)
+PHASE_WEIGHTS = (0, 4, 2, 1, 1, 0)
+# the phase of the starting position, which is all middlegame
+MAX_PHASE = 24
+SCORE_BITS = 20
+SCORE_HALF = 1 << (SCORE_BITS - 1)
+SCORE_MASK = (1 << SCORE_BITS) - 1
+
+def pack_score(middlegame : int, endgame : int, phase : int) -> int:
+    return middlegame + (endgame << SCORE_BITS) + (phase << (2 * SCORE_BITS))
+
+# the fields can be negative, so each one borrows from the next
+def unpack_score(score : int) -> tuple[int, int, int]:
+    middlegame = ((score + SCORE_HALF) & SCORE_MASK) - SCORE_HALF
+    score = (score - middlegame) >> SCORE_BITS
+    endgame = ((score + SCORE_HALF) & SCORE_MASK) - SCORE_HALF
+    return middlegame, endgame, (score - endgame) >> SCORE_BITS
+
+# blends the middlegame and endgame scores by how much material is left
+def taper_score(score : int) -> int:
+    middlegame, endgame, phase = unpack_score(score)
+    phase = min(phase, MAX_PHASE)
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+
+# the positional bonus of a white piece on a square, as (middlegame, endgame)
+def square_bonus(piece_id : PIECE_ID, square : int) -> tuple[int, int]:
+    rank, file = square >> 3, square & 7
+    # 5 on the four centre squares down to -1 in the corners
+    centre = 6 - (abs(2 * file - 7) + abs(2 * rank - 7)) // 2
+    if piece_id == PIECE_ID.pawn:
+        middlegame = (0, 0, 5, 10, 20, 30, 50, 0)[rank] + (10 if 3 <= file <= 4 and 3 <= rank <= 4 else 0)
+        return middlegame, (0, 5, 10, 20, 35, 60, 90, 0)[rank]
+    if piece_id == PIECE_ID.knight:
+        return centre * 8 - 15, centre * 6 - 12
+    if piece_id == PIECE_ID.bishop:
+        return centre * 4, centre * 3
+    if piece_id == PIECE_ID.rook:
+        return (10 if rank == 6 else 0) + (5 if 3 <= file <= 4 else 0), 8 if rank == 6 else 0
+    if piece_id == PIECE_ID.queen:
+        return centre * 2, centre * 4
+    # the king hides on its back rank until the endgame, then heads for the centre
+    return (15 if rank == 0 and not 3 <= file <= 5 else 0) - 12 * min(rank, 4), centre * 8 - 20
+
+# packed scores indexed like the zobrist piece keys, black pieces mirrored and
+# negated; code 0 (an empty square) scores nothing
+def build_piece_scores() -> list[list[int]]:
+    scores = [[0] * 64 for _ in range(16)]
+    for piece_id in PIECE_ID:
+        for square in range(64):
+            middlegame, endgame = square_bonus(piece_id, square)
+            middlegame += MIDDLEGAME_VALUES[piece_id]
+            endgame += ENDGAME_VALUES[piece_id]
+            scores[piece_id + 1][square] = pack_score(middlegame, endgame, PHASE_WEIGHTS[piece_id])
+            scores[(piece_id + 1) | BLACK_BIT][square ^ 56] = pack_score(-middlegame, -endgame, PHASE_WEIGHTS[piece_id])
+    return scores
+
+PIECE_SCORES = build_piece_scores()
+
+# the packed piece-square score of a board from scratch, as make_move keeps it
+def position_score(squares : bytearray) -> int:
+    score = 0
+    for square, code in enumerate(squares):
+        if code:
+            score += PIECE_SCORES[code & 0x0F][square]
+    return score
+
+def code_piece_id(code : int) -> PIECE_ID:
+    return PIECE_ID((code & KIND_MASK) - 1)
 
 class Piece:
+    __slots__ = ("piece_id", "is_black", "rank", "file", "moved")
+
     def __init__(self, piece_id: PIECE_ID, is_black : bool, rank : int = 0, file : int = 0):
         self.piece_id = piece_id
         self.is_black = is_black
@@ -79,10 +242,263 @@ class Piece:
         self.file = file
         self.moved = False
 
+    def to_code(self) -> int:
+        return pack_piece(self.piece_id, self.is_black, self.moved)
+
+    @classmethod
+    def from_code(cls, code : int, square : int):
+        piece = cls(code_piece_id(code), bool(code & BLACK_BIT), square >> 3, square & 7)
+        piece.moved = bool(code & MOVED_BIT)
+        return piece
+
 class Position:
-    def __init__(self, pieces : list[Piece]):
-        self.pieces = deepcopy(pieces)
-    
+    __slots__ = ("squares", "black_to_move", "ep_square", "halfmove_clock", "fullmove_number", "kings", "key", "score", "undo", "key_history")
+
+    # the board itself is a flat 64 byte mailbox of packed piece codes
+    # Piece objects are only built on request, as snapshots
+    # ep_square is the square a pawn has just skipped over, or -1
+    # halfmove_clock counts plies since the last capture or pawn move and
+    # fullmove_number goes up after every black move, as in FEN
+    # kings holds the white and black king squares (-1 if missing), key is
+    # the zobrist key and score the packed piece-square score, all kept up to
+    # date by make_move and unmake_move
+    def __init__(self, pieces : list[Piece] = (), squares : Union[bytearray, None] = None, black_to_move : bool = False, ep_square : int = -1,
+            halfmove_clock : int = 0, fullmove_number : int = 1):
+        self.black_to_move = black_to_move
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        self.undo = array('h')
+        self.key_history = array('Q')
+        if squares is not None:
+            self.squares = bytearray(squares)
+        else:
+            self.squares = bytearray(64)
+            for piece in pieces:
+                self.squares[square_index(piece.rank, piece.file)] = piece.to_code()
+        self.kings = [self.scan_king(False), self.scan_king(True)]
+        self.key = zobrist_key(self.squares, black_to_move, ep_square)
+        self.score = position_score(self.squares)
+
+    # copies the board and state but not the undo history
+    def copy(self):
+        position = Position.__new__(Position)
+        position.squares = bytearray(self.squares)
+        position.black_to_move = self.black_to_move
+        position.ep_square = self.ep_square
+        position.halfmove_clock = self.halfmove_clock
+        position.fullmove_number = self.fullmove_number
+        position.kings = self.kings.copy()
+        position.key = self.key
+        position.score = self.score
+        position.undo = array('h')
+        position.key_history = array('Q')
+        return position
+
+    # reads a FEN string; the clocks are optional and default to the start of a game
+    # castling rights become the moved flags of the kings and rooks
+    @classmethod
+    def from_fen(cls, fen : str):
+        fields = fen.split()
+        rows = fields[0].split("/") if fields else []
+        if len(rows) != 8:
+            raise ValueError("FEN must describe 8 ranks.")
+        squares = bytearray(64)
+        for rank, row in zip(range(7, -1, -1), rows):
+            file = 0
+            for char in row:
+                if char.isdigit():
+                    file += int(char)
+                    continue
+                if char.upper() not in PIECE_LETTERS or file > 7:
+                    raise ValueError(f"Invalid FEN rank {row}.")
+                squares[square_index(rank, file)] = pack_piece(PIECE_ID(PIECE_LETTERS.index(char.upper())), char.islower())
+                file += 1
+            if file != 8:
+                raise ValueError(f"Invalid FEN rank {row}.")
+        # one king a side, everything from check detection to the bitboards assumes it
+        for black in (False, True):
+            if squares.count(pack_piece(PIECE_ID.king, black)) != 1:
+                raise ValueError("FEN must have exactly one king for each side.")
+        side = fields[1] if len(fields) > 1 else "w"
+        if side not in ("w", "b"):
+            raise ValueError(f"Invalid FEN side to move {side}.")
+        castling = fields[2] if len(fields) > 2 else "-"
+        rights = 0
+        for bit, right in enumerate(CASTLING_SQUARES):
+            if right in castling:
+                rights |= 1 << bit
+        ep = fields[3] if len(fields) > 3 else "-"
+        if ep != "-" and ep.upper() not in SQUARE_INDEX:
+            raise ValueError(f"Invalid FEN en passant square {ep}.")
+        ep_square = -1 if ep == "-" else SQUARE_INDEX[ep.upper()]
+        black_to_move = side == "b"
+        # only keep an en passant square a pawn has just skipped: on the sixth rank
+        # for white to move or the third for black, empty, with the enemy pawn in front
+        if ep_square != -1:
+            captured = ep_square - 8 if not black_to_move else ep_square + 8
+            if (ep_square >> 3 != (2 if black_to_move else 5) or squares[ep_square]
+                    or squares[captured] != pack_piece(PIECE_ID.pawn, not black_to_move)):
+                ep_square = -1
+        try:
+            halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("FEN move clocks must be numbers.")
+        return cls.from_state(squares, black_to_move, rights, ep_square, halfmove_clock, fullmove_number)
+
+    def to_fen(self) -> str:
+        rows = []
+        for rank in range(7, -1, -1):
+            row = ""
+            empty = 0
+            for file in range(8):
+                code = self.squares[square_index(rank, file)]
+                if not code:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                letter = PIECE_LETTERS[(code & KIND_MASK) - 1]
+                row += letter.lower() if code & BLACK_BIT else letter
+            rows.append(row + (str(empty) if empty else ""))
+        rights = castling_rights(self.squares)
+        castling = "".join(right for bit, right in enumerate(CASTLING_SQUARES) if rights >> bit & 1) or "-"
+        ep = SQUARE_NAMES[self.ep_square].lower() if self.ep_square != -1 else "-"
+        side = "b" if self.black_to_move else "w"
+        return f"{'/'.join(rows)} {side} {castling} {ep} {self.halfmove_clock} {self.fullmove_number}"
+
+    # builds a position from piece codes and castling rights (a KQkq bit mask, as
+    # returned by castling_rights) for formats that don't track moved flags:
+    # every piece counts as moved except pawns on their starting rank and the
+    # kings and rooks that still have castling rights
+    @classmethod
+    def from_state(cls, squares : bytes, black_to_move : bool, rights : int, ep_square : int = -1,
+            halfmove_clock : int = 0, fullmove_number : int = 1):
+        squares = bytearray(code | MOVED_BIT if code else EMPTY for code in squares)
+        # pawns on their starting rank keep their double move
+        for square in range(8, 16):
+            if squares[square] == pack_piece(PIECE_ID.pawn, False, True):
+                squares[square] &= ~MOVED_BIT
+        for square in range(48, 56):
+            if squares[square] == pack_piece(PIECE_ID.pawn, True, True):
+                squares[square] &= ~MOVED_BIT
+        for bit, (right, (king, rook)) in enumerate(CASTLING_SQUARES.items()):
+            if rights >> bit & 1 and squares[king] & ~MOVED_BIT == pack_piece(PIECE_ID.king, right.islower()) \
+                    and squares[rook] & ~MOVED_BIT == pack_piece(PIECE_ID.rook, right.islower()):
+                squares[king] &= ~MOVED_BIT
+                squares[rook] &= ~MOVED_BIT
+        return cls(squares=squares, black_to_move=black_to_move, ep_square=ep_square,
+            halfmove_clock=halfmove_clock, fullmove_number=fullmove_number)
+
+    @property
+    def pieces(self) -> list[Piece]:
+        return [Piece.from_code(code, sq) for sq, code in enumerate(self.squares) if code]
+
+    @pieces.setter
+    def pieces(self, pieces : list[Piece]):
+        self.squares = Position(pieces).squares
+        self.kings = [self.scan_king(False), self.scan_king(True)]
+        self.key = zobrist_key(self.squares, self.black_to_move, self.ep_square)
+        self.score = position_score(self.squares)
+
+    def piece_at(self, square : int) -> Union[Piece, None]:
+        code = self.squares[square]
+        return Piece.from_code(code, square) if code else None
+
+    def find_king(self, is_black : bool) -> int:
+        return self.kings[is_black]
+
+    def scan_king(self, is_black : bool) -> int:
+        code = pack_piece(PIECE_ID.king, is_black)
+        square = self.squares.find(code)
+        if square == -1:
+            square = self.squares.find(code | MOVED_BIT)
+        return square
+
+    # applies a move in place; assumes the move has already been validated
+    # the zobrist key and score are updated incrementally from the squares that change
+    def make_move(self, start : int, end : int, promotion : PIECE_ID = PIECE_ID.queen):
+        squares = self.squares
+        code = squares[start]
+        piece_id = (code & KIND_MASK) - 1
+        key = self.key ^ ZOBRIST_BLACK_TO_MOVE
+        if ep_capturable(squares, self.ep_square):
+            key ^= ZOBRIST_EP[self.ep_square & 7]
+        corner_move = start in CASTLING_CORNERS or end in CASTLING_CORNERS
+        if corner_move:
+            key ^= ZOBRIST_CASTLING[castling_rights(squares)]
+        captured_square = end
+        rook_start = -1
+        rook_code = EMPTY
+        ep_square = -1
+        if piece_id == PIECE_ID.king:
+            self.kings[(code & BLACK_BIT) >> 3] = end
+            # castling moves the rook to the square the king passed over
+            if abs((start & 7) - (end & 7)) == 2:
+                rook_start = end + 1 if end > start else end - 2
+                rook_code = squares[rook_start]
+                rook_end = (start + end) >> 1
+                squares[rook_end] = rook_code | MOVED_BIT
+                squares[rook_start] = EMPTY
+                key ^= ZOBRIST_PIECES[rook_code & 0x0F][rook_start] ^ ZOBRIST_PIECES[rook_code & 0x0F][rook_end]
+                self.score += PIECE_SCORES[rook_code & 0x0F][rook_end] - PIECE_SCORES[rook_code & 0x0F][rook_start]
+        new_code = code | MOVED_BIT
+        if piece_id == PIECE_ID.pawn:
+            if end >> 3 == 7 or end >> 3 == 0:
+                new_code = (new_code & ~KIND_MASK) | (promotion + 1)
+            elif end == self.ep_square and (start ^ end) & 7:
+                # en passant captures the pawn that skipped over the end square
+                captured_square = end + 8 if code & BLACK_BIT else end - 8
+            elif abs(end - start) == 16:
+                ep_square = (start + end) >> 1
+        captured = squares[captured_square]
+        if captured:
+            key ^= ZOBRIST_PIECES[captured & 0x0F][captured_square]
+        key ^= ZOBRIST_PIECES[code & 0x0F][start] ^ ZOBRIST_PIECES[new_code & 0x0F][end]
+        self.score += PIECE_SCORES[new_code & 0x0F][end] - PIECE_SCORES[code & 0x0F][start] - PIECE_SCORES[captured & 0x0F][captured_square]
+        self.undo.extend((start, end, code, captured_square, captured, rook_start, rook_code, self.ep_square, self.halfmove_clock))
+        self.key_history.append(self.key)
+        # overwriting the endpoint indirectly removes the piece that we're capturing
+        squares[captured_square] = EMPTY
+        squares[end] = new_code
+        squares[start] = EMPTY
+        if corner_move:
+            key ^= ZOBRIST_CASTLING[castling_rights(squares)]
+        if ep_capturable(squares, ep_square):
+            key ^= ZOBRIST_EP[ep_square & 7]
+        self.key = key
+        self.ep_square = ep_square
+        self.halfmove_clock = 0 if captured or piece_id == PIECE_ID.pawn else self.halfmove_clock + 1
+        if self.black_to_move:
+            self.fullmove_number += 1
+        self.black_to_move = not self.black_to_move
+
+    # reverts the last make_move
+    def unmake_move(self):
+        undo = self.undo
+        start, end, code, captured_square, captured, rook_start, rook_code, ep_square, halfmove_clock = undo[-UNDO_SIZE:]
+        del undo[-UNDO_SIZE:]
+        squares = self.squares
+        self.score += PIECE_SCORES[code & 0x0F][start] + PIECE_SCORES[captured & 0x0F][captured_square] - PIECE_SCORES[squares[end] & 0x0F][end]
+        squares[end] = EMPTY
+        squares[captured_square] = captured
+        squares[start] = code
+        if (code & KIND_MASK) - 1 == PIECE_ID.king:
+            self.kings[(code & BLACK_BIT) >> 3] = start
+        if rook_start != -1:
+            rook_end = (start + end) >> 1
+            self.score += PIECE_SCORES[rook_code & 0x0F][rook_start] - PIECE_SCORES[rook_code & 0x0F][rook_end]
+            squares[rook_end] = EMPTY
+            squares[rook_start] = rook_code
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        self.black_to_move = not self.black_to_move
+        if self.black_to_move:
+            self.fullmove_number -= 1
+        self.key = self.key_history.pop()
+
     def get_piece_positions(self) -> dict[str, Piece]:
         positions = dict()
         for piece in self.pieces:
@@ -104,7 +520,7 @@ class PositionRenderer:
 
     def render(self, position : Position, reversed : bool = False):
         board = ""
-        positions = position.get_piece_positions()
+        squares = position.squares
         back_range = range(7,-1,-1)
         forward_range = range(0, 8, 1)
         for file in (forward_range if not reversed else back_range):
@@ -118,10 +534,9 @@ class PositionRenderer:
                 if (rank + file) % 2 == 1:
                     # white space
                     back = self.chars[CHAR_ID.white_space]
-                coord = coord_to_position(rank, file) 
-                if coord in positions:
-                    piece = positions[coord]
-                    board += get_unicode_char(piece.piece_id, piece.is_black, self.darkmode) + ' '
+                code = squares[square_index(rank, file)]
+                if code:
+                    board += get_unicode_char(code_piece_id(code), bool(code & BLACK_BIT), self.darkmode) + ' '
                 else:
                     board += back * 2
             board += "\n"
@@ -129,21 +544,23 @@ class PositionRenderer:
 
 
 class MoveStrategyChecker():
+    # method names rather than methods, so that lookups go through the class
+    # and pick up anything that wraps or overrides them
+    STRATEGIES = {
+        PIECE_ID.pawn : "check_pawn_move",
+        PIECE_ID.knight : "check_knight_move",
+        PIECE_ID.king: "check_king_move",
+        PIECE_ID.bishop: "check_bishop_move",
+        PIECE_ID.queen: "check_queen_move",
+        PIECE_ID.rook: "check_rook_move"
+    }
 
     @classmethod
-    def check_move(cls, piece : Piece, end_position : str) -> bool:
-        end_coords = position_to_coord(end_position)
-        strategies = {
-            PIECE_ID.pawn : cls.check_pawn_move,
-            PIECE_ID.knight : cls.check_knight_move,
-            PIECE_ID.king: cls.check_king_move,
-            PIECE_ID.bishop: cls.check_bishop_move,
-            PIECE_ID.queen: cls.check_queen_move,
-            PIECE_ID.rook: cls.check_rook_move
-        }
-        if end_coords[0] > 7 or end_coords[0] < 0 or end_coords[1] > 7 or end_coords[1] < 0:
+    def check_move(cls, piece : Piece, end : int) -> bool:
+        if not 0 <= end < 64:
             return False
-        return strategies[piece.piece_id](piece, end_coords)
+        end_coords = (end & 7, end >> 3)
+        return getattr(cls, cls.STRATEGIES[piece.piece_id])(piece, end_coords)
 
     @classmethod
     def check_pawn_move(cls, piece : Piece, end_coords : tuple[int,int]):
@@ -203,7 +620,7 @@ class MoveStrategyChecker():
         x_move = abs(piece.file - end_coords[0])
         y_move = abs(piece.rank - end_coords[1])
         if not ((x_move == 0 and y_move > 0) or (x_move > 0 and y_move == 0) or (x_move == y_move)):
-            d_print(f"{x_move},{y_move}")
+            d_print("%d,%d", x_move, y_move)
             d_print("Queens must move along a rank or file or diagonally.")
             return False
         if x_move == 0 and y_move == 0:
@@ -227,25 +644,24 @@ class MoveStrategyChecker():
         return True
 
 class PieceChecker():
-    
+    STRATEGIES = {
+        PIECE_ID.pawn : "check_pawn_move",
+        PIECE_ID.knight : "check_knight_move",
+        PIECE_ID.king: "check_bqkr_move",
+        PIECE_ID.bishop: "check_bqkr_move",
+        PIECE_ID.queen: "check_bqkr_move",
+        PIECE_ID.rook: "check_bqkr_move"
+    }
+
     @classmethod
-    def check_move(cls, board : Position, piece : Piece, end_position : str, black_to_move : bool):
-        end_coords = position_to_coord(end_position)
-        strategies = {
-            PIECE_ID.pawn : cls.check_pawn_move,
-            PIECE_ID.knight : cls.check_knight_move,
-            PIECE_ID.king: cls.check_bqkr_move,
-            PIECE_ID.bishop: cls.check_bqkr_move,
-            PIECE_ID.queen: cls.check_bqkr_move,
-            PIECE_ID.rook: cls.check_bqkr_move
-        }
-        return strategies[piece.piece_id](board, piece, end_coords, black_to_move)
+    def check_move(cls, board : Position, piece : Piece, end : int, black_to_move : bool):
+        end_coords = (end & 7, end >> 3)
+        return getattr(cls, cls.STRATEGIES[piece.piece_id])(board, piece, end_coords, black_to_move)
 
     @classmethod 
     def check_endpoint(cls, board : Position, piece : Piece, end_position : tuple[int, int], black_to_move : bool):    
-        positions = board.get_piece_positions()
-        at_endpoint = positions.get(coord_to_position(end_position[1], end_position[0]))
-        if at_endpoint != None and at_endpoint.is_black == black_to_move:
+        at_endpoint = board.squares[square_index(end_position[1], end_position[0])]
+        if at_endpoint and bool(at_endpoint & BLACK_BIT) == black_to_move:
             d_print("Can't move onto your own piece.")
             return False
         return True
@@ -256,40 +672,42 @@ class PieceChecker():
         y_move = end_coords[1] - piece.rank
         x_increment = int(x_move / abs(x_move)) if x_move != 0 else 0
         y_increment = int(y_move / abs(y_move)) if y_move != 0 else 0
-        cur_x = piece.file + x_increment # start from next space to move
-        cur_y = piece.rank + y_increment
-        positions = board.get_piece_positions()
+        step = square_index(y_increment, x_increment)
+        squares = board.squares
+        end = square_index(end_coords[1], end_coords[0])
+        cur = square_index(piece.rank, piece.file) + step # start from next space to move
         # ends BEFORE endpoint as this is a separate check
-        while not (cur_x == end_coords[0] and cur_y == end_coords[1]):
-            position = coord_to_position(cur_y, cur_x)
-            at_position = positions.get(position)
-            if at_position != None:
+        while cur != end:
+            if squares[cur]:
                 d_print("There is a piece in the way of making this move.")
                 return False
-            cur_x += x_increment
-            cur_y += y_increment
+            cur += step
         return True
 
-    # en passant not yet implemented
     @classmethod
     def check_pawn_move(cls, board : Position, piece : Piece, end_coords : tuple[int, int], black_to_move : bool):
-        positions = board.get_piece_positions()
-        at_endpoint = positions.get(coord_to_position(end_coords[1], end_coords[0]))
-        if abs(end_coords[0] - piece.file) == 1 and (at_endpoint == None or at_endpoint.is_black == black_to_move):
+        squares = board.squares
+        end = square_index(end_coords[1], end_coords[0])
+        at_endpoint = squares[end]
+        if abs(end_coords[0] - piece.file) == 1 and not at_endpoint and end == board.ep_square:
+            # en passant, as long as there is an enemy pawn to take beside us
+            captured = squares[square_index(piece.rank, end_coords[0])]
+            return (captured & (MOVED_BIT - 1)) == pack_piece(PIECE_ID.pawn, not black_to_move)
+        if abs(end_coords[0] - piece.file) == 1 and (not at_endpoint or bool(at_endpoint & BLACK_BIT) == black_to_move):
             # must be capturing to move diagonally
             # and can't capture own piece
             d_print("You can't move diagonally unless you're capturing, and can't capture your own piece.")
             return False
-        if not abs(end_coords[0] - piece.file) == 1 and at_endpoint != None:
+        if not abs(end_coords[0] - piece.file) == 1 and at_endpoint:
             # can only capture diagonally or something is in our way
             d_print("You can only capture diagonally.")
             return False
         if abs(end_coords[1] - piece.rank) == 2:
             if end_coords[1] < piece.rank:
-                to_check = positions.get( coord_to_position(piece.rank - 1, piece.file) )
+                to_check = squares[square_index(piece.rank - 1, piece.file)]
             else:
-                to_check = positions.get( coord_to_position(piece.rank + 1, piece.file) )
-            if to_check != None:
+                to_check = squares[square_index(piece.rank + 1, piece.file)]
+            if to_check:
                 # there's something in the way of moving to that spot
                 return False
         return True
@@ -310,248 +728,536 @@ class PieceChecker():
             return False
         return True
     
+    # attacked is the opponent's attack map, as from attacked_squares, when the
+    # caller already has one
     @classmethod
-    def check_castling(cls, position : Position, start_position : str, end_position : str, black_to_move : bool):
-        piece_positions = position.get_piece_positions()
-        piece = piece_positions.get(start_position)
+    def check_castling(cls, position : Position, start : int, end : int, black_to_move : bool,
+            attacked : Union[bytearray, None] = None):
+        piece = position.piece_at(start)
         
         # if we're not moving a king
         if not piece.piece_id == PIECE_ID.king: return True
         
-        start_coords = position_to_coord(start_position)
-        end_coords = position_to_coord(end_position)
-        x_diff = end_coords[0] - start_coords[0]
+        x_diff = (end & 7) - (start & 7)
         # if you're not trying to castle
         if abs(x_diff) != 2: return True
         if piece.moved: return False
 
-        mid = coord_to_position(end_coords[1], end_coords[0] + int(x_diff / 2))
+        if attacked is None:
+            attacked = attacked_squares(position, not black_to_move)
+        # can't castle out of check
+        if attacked[start]: return False
         # if player is attempting to castle through check
         # we don't check for endpoint or obstacles because those are already handled by separate, generic checks
-        if CheckChecker.check_can_attack(position, not black_to_move, mid): return False
+        if attacked[(start + end) >> 1]: return False
 
-        rook_position = find_rook_position(piece.is_black, end_position)
-        rook = piece_positions.get(rook_position)
-        if rook != None and rook.piece_id == PIECE_ID.rook and not rook.moved:
+        # the generic endpoint check allows captures, but castling never captures
+        if position.squares[end]: return False
+        rook_square = end + 1 if x_diff > 0 else end - 2
+        # queenside, the square next to the rook also has to be empty
+        if x_diff < 0 and position.squares[rook_square + 1]: return False
+        if position.squares[rook_square] == pack_piece(PIECE_ID.rook, piece.is_black):
             return True
 
         return False
 
 class CheckChecker:
     @classmethod
-    def check_can_attack(cls, board : Position, team_is_black : bool, to_attack : str):
-        pieces = [piece for piece in board.pieces if piece.is_black == team_is_black]
-        for piece in pieces:
-            # if any piece can attack the space, the space can be attacked
-            # if piece.piece_id == PIECE_ID.king:
-            #     # no pawns in pieces? O.o
-            #     print(f"Bishop can attack: {MoveStrategyChecker.check_move(piece, to_attack)}")
-            if MoveStrategyChecker.check_move(piece, to_attack) and PieceChecker.check_move(board, piece, to_attack, team_is_black):
-                d_print("A piece can give check to king.")
-                return True
-        return False  
+    def check_can_attack(cls, board : Position, team_is_black : bool, to_attack : int):
+        return is_attacked(board, to_attack, team_is_black)
 
     # tuple stores [is black in check? is white in check?]
+    # callers that only care about one side should use is_in_check
     @classmethod
     def check_check(cls, board : Position) -> tuple[bool, bool]:
-        black_king = None
-        white_king = None
-        # get black king and white king
-        for piece in board.pieces:
-            if piece.piece_id == PIECE_ID.king:
-                if piece.is_black:
-                    black_king = piece
-                else:
-                    white_king = piece
-                if black_king is not None and white_king is not None:
-                    break
-
-        black_position = coord_to_position(black_king.rank, black_king.file)
-        d_print(f"Black King position is {black_position}")
-        white_position = coord_to_position(white_king.rank, white_king.file)
-        d_print(f"White King position is {white_position}")
-
-        return (
-            cls.check_can_attack(board, False, black_position),
-            cls.check_can_attack(board, True, white_position)
-        )
-    
+        return (is_in_check(board, True), is_in_check(board, False))
+
+# precomputed square lists for walking the mailbox: orthogonal directions come
+# first in STEPS, then diagonals
+STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+KNIGHT_STEPS = ((1, 2), (2, 1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-2, -1), (-1, -2))
+
+def build_square_lists(rank_step : int, file_step : int, slide : bool) -> list[tuple[int]]:
+    lists = []
+    for square in range(64):
+        rank, file = (square >> 3) + rank_step, (square & 7) + file_step
+        squares = []
+        while 0 <= rank < 8 and 0 <= file < 8:
+            squares.append(square_index(rank, file))
+            if not slide:
+                break
+            rank += rank_step
+            file += file_step
+        lists.append(tuple(squares))
+    return lists
+
+RAY_SQUARES = [build_square_lists(rank_step, file_step, True) for rank_step, file_step in STEPS]
+KING_SQUARES = [tuple(sq for step in STEPS for sq in build_square_lists(*step, False)[square]) for square in range(64)]
+KNIGHT_SQUARES = [tuple(sq for step in KNIGHT_STEPS for sq in build_square_lists(*step, False)[square]) for square in range(64)]
+# squares a pawn attacks, indexed by colour (0 white, 1 black) then square
+PAWN_SQUARES = tuple(
+    [tuple(sq for step in steps for sq in build_square_lists(*step, False)[square]) for square in range(64)]
+    for steps in (((1, 1), (1, -1)), ((-1, 1), (-1, -1)))
+)
+
+# every square attacked by by_black's pieces; sliders see through the square
+# through, so that a king can't step back along the ray that checks it
+def attacked_squares(position : Position, by_black : bool, through : int = -1) -> bytearray:
+    squares = position.squares
+    attacked = bytearray(64)
+    team_bit = BLACK_BIT if by_black else 0
+    for square, code in enumerate(squares):
+        if not code or (code & BLACK_BIT) != team_bit:
+            continue
+        piece_id = (code & KIND_MASK) - 1
+        if piece_id == PIECE_ID.pawn:
+            targets = PAWN_SQUARES[by_black][square]
+        elif piece_id == PIECE_ID.knight:
+            targets = KNIGHT_SQUARES[square]
+        elif piece_id == PIECE_ID.king:
+            targets = KING_SQUARES[square]
+        else:
+            first = 4 if piece_id == PIECE_ID.bishop else 0
+            last = 4 if piece_id == PIECE_ID.rook else 8
+            for direction in range(first, last):
+                for target in RAY_SQUARES[direction][square]:
+                    attacked[target] = 1
+                    if squares[target] and target != through:
+                        break
+            continue
+        for target in targets:
+            attacked[target] = 1
+    return attacked
+
+# the squares of by_black's pieces that attack square
+def attackers(position : Position, square : int, by_black : bool) -> list[int]:
+    squares = position.squares
+    team_bit = BLACK_BIT if by_black else 0
+    found = []
+    # look outwards from the square using each piece's own geometry
+    for targets, piece_id in ((PAWN_SQUARES[not by_black][square], PIECE_ID.pawn), (KNIGHT_SQUARES[square], PIECE_ID.knight),
+            (KING_SQUARES[square], PIECE_ID.king)):
+        code = pack_piece(piece_id, by_black)
+        for target in targets:
+            if squares[target] & ~MOVED_BIT == code:
+                found.append(target)
+    for direction in range(8):
+        slider = PIECE_ID.rook if direction < 4 else PIECE_ID.bishop
+        for target in RAY_SQUARES[direction][square]:
+            code = squares[target]
+            if code:
+                piece_id = (code & KIND_MASK) - 1
+                if (code & BLACK_BIT) == team_bit and (piece_id == slider or piece_id == PIECE_ID.queen):
+                    found.append(target)
+                break
+    return found
+
+# like attackers, but stops at the first one found
+def is_attacked(position : Position, square : int, by_black : bool) -> bool:
+    squares = position.squares
+    team_bit = BLACK_BIT if by_black else 0
+    knight = pack_piece(PIECE_ID.knight, by_black)
+    for target in KNIGHT_SQUARES[square]:
+        if squares[target] & ~MOVED_BIT == knight:
+            return True
+    pawn = pack_piece(PIECE_ID.pawn, by_black)
+    for target in PAWN_SQUARES[not by_black][square]:
+        if squares[target] & ~MOVED_BIT == pawn:
+            return True
+    king = pack_piece(PIECE_ID.king, by_black)
+    for target in KING_SQUARES[square]:
+        if squares[target] & ~MOVED_BIT == king:
+            return True
+    for direction in range(8):
+        slider = PIECE_ID.rook if direction < 4 else PIECE_ID.bishop
+        for target in RAY_SQUARES[direction][square]:
+            code = squares[target]
+            if code:
+                piece_id = (code & KIND_MASK) - 1
+                if (code & BLACK_BIT) == team_bit and (piece_id == slider or piece_id == PIECE_ID.queen):
+                    return True
+                break
+    return False
+
+def is_in_check(position : Position, black : bool) -> bool:
+    king = position.kings[black]
+    return king != -1 and is_attacked(position, king, not black)
+
+class LegalityChecker:
+    __slots__ = ("position", "black_to_move", "king", "checkers", "evasions", "pins", "attacked")
+
+    # computes once per position everything needed to accept or reject moves
+    # without playing them: the pieces giving check, the squares that block or
+    # capture a single checker, pinned pieces with the squares they may still
+    # move to, and every square the opponent attacks (seen through our king,
+    # so it can't step back along a checking ray)
+    def __init__(self, position : Position, black_to_move : bool):
+        self.position = position
+        self.black_to_move = black_to_move
+        squares = position.squares
+        king = position.find_king(black_to_move)
+        self.king = king
+        self.checkers = attackers(position, king, not black_to_move)
+        self.evasions = set()
+        self.pins = dict()
+        self.attacked = attacked_squares(position, not black_to_move, king)
+        enemy_bit = 0 if black_to_move else BLACK_BIT
+        if len(self.checkers) == 1:
+            checker = self.checkers[0]
+            self.evasions.add(checker)
+            self.evasions.update(self.between(king, checker))
+        # walk out from the king: one of our pieces followed by an enemy slider
+        # moving along that line means the piece is pinned
+        for direction in range(8):
+            pinned = None
+            for target in RAY_SQUARES[direction][king]:
+                code = squares[target]
+                if not code:
+                    continue
+                if (code & BLACK_BIT) != enemy_bit:
+                    if pinned is not None:
+                        break
+                    pinned = target
+                    continue
+                piece_id = (code & KIND_MASK) - 1
+                slides = piece_id == PIECE_ID.queen or piece_id == (PIECE_ID.rook if direction < 4 else PIECE_ID.bishop)
+                if pinned is not None and slides:
+                    self.pins[pinned] = set(self.between(king, target)) | {target}
+                break
+
+    @classmethod
+    def between(cls, start : int, end : int) -> list[int]:
+        for ray in RAY_SQUARES:
+            squares = ray[start]
+            if end in squares:
+                return list(squares[:squares.index(end)])
+        return []
+
+    def in_check(self) -> bool:
+        return len(self.checkers) > 0
+
+    # whether a move that is otherwise valid for the piece leaves our king safe
+    def is_legal(self, start : int, end : int) -> bool:
+        if start == self.king:
+            # castling through check is handled by PieceChecker.check_castling
+            return not self.attacked[end]
+        position = self.position
+        code = position.squares[start]
+        # en passant removes a second piece from the board, so just play it
+        if end == position.ep_square and (code & KIND_MASK) - 1 == PIECE_ID.pawn and (start ^ end) & 7:
+            position.make_move(start, end)
+            in_check = is_in_check(position, self.black_to_move)
+            position.unmake_move()
+            return not in_check
+        if len(self.checkers) > 1:
+            return False
+        if self.checkers and end not in self.evasions:
+            return False
+        pin = self.pins.get(start)
+        if pin is not None and end not in pin:
+            return False
+        return True
+
+# generates candidate moves for a piece as packed moves, from its movement
+# pattern alone; the checkers decide which of them are legal
 class MoveMaker():
+    STRATEGIES = {
+        PIECE_ID.pawn: "make_pawn_move",
+        PIECE_ID.king: "make_king_move",
+        PIECE_ID.queen: "make_queen_move",
+        PIECE_ID.rook: "make_rook_move",
+        PIECE_ID.bishop: "make_bishop_move",
+        PIECE_ID.knight: "make_knight_move"
+    }
+
+    @classmethod
+    def make_possible_moves(cls, position : Position, piece : Piece) -> array:
+        return getattr(cls, cls.STRATEGIES[piece.piece_id])(piece)
+
+    # packs the moves from piece's square by each (rank, file) offset that stays on the board
     @classmethod
-    def make_possible_moves(cls, position : Position, piece : Piece):
-        strategies = {
-            PIECE_ID.pawn: cls.make_pawn_move,
-            PIECE_ID.king: cls.make_king_move,
-            PIECE_ID.queen: cls.make_queen_move,
-            PIECE_ID.rook: cls.make_rook_move,
-            PIECE_ID.bishop: cls.make_bishop_move,
-            PIECE_ID.knight: cls.make_knight_move
-        }
-        return strategies[piece.piece_id](piece)
+    def make_offset_moves(cls, piece : Piece, offsets) -> array:
+        start = square_index(piece.rank, piece.file)
+        moves = array('H')
+        for rank_step, file_step in offsets:
+            rank = piece.rank + rank_step
+            file = piece.file + file_step
+            if rank >= 0 and rank < 8 and file >= 0 and file < 8:
+                moves.append(pack_move(start, square_index(rank, file)))
+        return moves
     
     @classmethod
-    def make_pawn_move(cls, piece : Piece):
+    def make_pawn_move(cls, piece : Piece) -> array:
         forward = -1 if piece.is_black else 1
-        start_position = coord_to_position(piece.rank, piece.file)
-        moves = []
-        cases = [ (forward, 0), (forward * 2, 0), (forward, 1), (forward, -1) ]
-        for case in cases:
-            end_coord = (piece.rank + case[0], piece.file + case[1])
-            if end_coord[0] >= 0 and end_coord[0] < 8 and end_coord[1] >= 0 and end_coord[1] < 8:
-                end_position = coord_to_position(end_coord[0], end_coord[1])
-                moves.append((start_position, end_position))
-        return moves
+        return cls.make_offset_moves(piece, ((forward, 0), (forward * 2, 0), (forward, 1), (forward, -1)))
 
     @classmethod
-    def make_king_move(cls, piece : Piece):
-        moves = []
-        start_position = coord_to_position(piece.rank, piece.file)
-        for x_move in range(-2, 3): # account for castling
-            for y_move in range(-1, 2):
-                if x_move == 0 and y_move == 0:
-                    continue
-                final_y = piece.rank + y_move
-                final_x = piece.file + x_move
-                if final_x > 7 or final_x < 0 or final_y > 7 or final_y < 0:
-                    continue
-                end_position = coord_to_position(final_y, final_x)
-                moves.append((start_position, end_position))
-        return moves
+    def make_king_move(cls, piece : Piece) -> array:
+        # two files sideways account for castling
+        return cls.make_offset_moves(piece, ((y_move, x_move) for x_move in range(-2, 3) for y_move in range(-1, 2) if x_move or y_move))
 
     @classmethod
-    def make_queen_move(cls, piece):
-        moves = []
-        moves.extend(cls.make_rook_move(piece))
+    def make_queen_move(cls, piece) -> array:
+        moves = cls.make_rook_move(piece)
         moves.extend(cls.make_bishop_move(piece))
         return moves
 
     @classmethod
-    def make_rook_move(cls, piece : Piece):
-        moves = []
-        start_position = coord_to_position(piece.rank, piece.file)
+    def make_rook_move(cls, piece : Piece) -> array:
+        start = square_index(piece.rank, piece.file)
+        moves = array('H')
         for x_move in range(8):
-            end_position = coord_to_position(piece.rank, x_move)
-            moves.append((start_position, end_position))
+            if x_move != piece.file:
+                moves.append(pack_move(start, square_index(piece.rank, x_move)))
         for y_move in range(8):
-            end_position = coord_to_position(y_move, piece.file)
+            if y_move != piece.rank:
+                moves.append(pack_move(start, square_index(y_move, piece.file)))
         return moves
 
     @classmethod
-    def make_bishop_move(cls, piece : Piece):
-        moves = []
-        start_position = coord_to_position(piece.rank, piece.file)
-        for distance in range(1,8):
-            # down-right (+,+)
-            if piece.rank + distance < 8 and piece.file + distance < 8:
-                end_position = coord_to_position(piece.rank + distance, piece.file + distance)
-                moves.append((start_position, end_position))
-            # down-left (-,+)
-            if piece.rank + distance < 8 and piece.file - distance >= 0:
-                end_position = coord_to_position(piece.rank + distance, piece.file - distance)
-                moves.append((start_position, end_position))
-            # up-right (+,-)
-            if piece.rank - distance >= 0 and piece.file + distance < 8:
-                end_position = coord_to_position(piece.rank - distance, piece.file + distance)
-                moves.append((start_position, end_position))
-            # up-left (-,-)
-            if piece.rank - distance >= 0 and piece.file - distance >= 0:
-                end_position = coord_to_position(piece.rank - distance, piece.file - distance)
-                moves.append((start_position, end_position))
-        return moves
+    def make_bishop_move(cls, piece : Piece) -> array:
+        return cls.make_offset_moves(piece, ((rank_step * distance, file_step * distance)
+            for distance in range(1, 8) for rank_step, file_step in ((1, 1), (1, -1), (-1, 1), (-1, -1))))
 
     @classmethod
-    def make_knight_move(cls, piece : Piece):
+    def make_knight_move(cls, piece : Piece) -> array:
         # cases: x = 2, y = 1; y = 2, x = 1 and abs equivalents
-        moves = []
-        start_position = coord_to_position(piece.rank, piece.file)
-        cases : list[tuple[int]] = [ (1,2), (2,1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-2, -1), (-1, -2) ]
-        for case in cases:
-            end_coord = (piece.rank + case[0], piece.file + case[1])
-            if end_coord[0] >= 0 and end_coord[0] < 8 and end_coord[1] >= 0 and end_coord[1] < 8:
-                end_position = coord_to_position(end_coord[0], end_coord[1])
-                moves.append((start_position, end_position))
-        return moves
+        return cls.make_offset_moves(piece, ((1,2), (2,1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-2, -1), (-1, -2)))
 
 class Game():
-    def __init__(self, renderer : Union[PositionRenderer, None] = None, pawn_choice = None):
+    # alternative move generation backend, see set_move_generator
+    move_generator = None
+    # opening book consulted by book_move, see set_book
+    book = None
+    # endgame tablebases consulted by tablebase_move and the search, see set_tablebases
+    tablebases = None
+
+    # verbose games print check messages as moves are made
+    # fen sets the position the game starts, and restarts, from
+    def __init__(self, renderer : Union[PositionRenderer, None] = None, pawn_choice = None, verbose : bool = True, fen : Union[str, None] = None):
         self.renderer = renderer
-        self.prev_moves = []
+        self.start_fen = fen
+        # packed moves played since setup, only turned into strings when written out
+        self.prev_moves = array('H')
+        # legal moves and check status of the position to move, worked out
+        # once per ply by legal_moves and in_check, dropped by invalidate
+        self.ply_moves = None
+        self.ply_move_set = None
+        self.ply_check = None
         self.king_moved = [False, False]
         if renderer is None:
             self.renderer = PositionRenderer()
         self.setup()
-        self.pawn_choice = pawn_choice
-
-    @classmethod
-    def new_position_from_move(self, prev_position : Position, start_position : str, end_position : str, make_pawn_choice : callable) -> Position:
-        new_position = deepcopy(prev_position)
-        start_coords = position_to_coord(start_position)
-        end_coords = position_to_coord(end_position)
-        new_pieces = []
-        # indirectly, remove the piece that we're capturing
-        for piece in new_position.pieces:
-            if piece.file != end_coords[0] or piece.rank != end_coords[1]:
-                new_pieces.append(piece)
-            else:
-                # some kind of behaviour to indicate capture
-                pass
-        new_position.pieces = new_pieces
-        piece_positions = new_position.get_piece_positions()
-        piece = piece_positions.get(start_position)
-        # check for castling as we then need to move *two* pieces
-        # if it's an invalid castle it should have been dealt with long ago
-        if piece.piece_id == PIECE_ID.king and abs(start_coords[0] - end_coords[0]) == 2:
-            rook_position = find_rook_position(piece.is_black,end_position)
-            rook = piece_positions.get(rook_position)
-            if rook.file == 0: rook.file = 3
-            elif rook.file == 7: rook.file = 5
-            rook.moved = True
-        # spicy logic here but as pawns can't go backwards, should be fine
-        elif piece.piece_id == PIECE_ID.pawn and (end_coords[1] == 7 or end_coords[1] == 0):
-            pawn_choice : int = make_pawn_choice()
-            piece.piece_id = pawn_choice
+        self.pawn_choice = pawn_choice if pawn_choice is not None else Game.always_promote_queen
+        self.verbose = verbose
 
-        piece.file, piece.rank = end_coords
-        piece.moved = True
+    # make_pawn_choice is only asked when a pawn promotes and move doesn't name the piece
+    @classmethod
+    def new_position_from_move(self, prev_position : Position, move : int, make_pawn_choice : callable) -> Position:
+        new_position = prev_position.copy()
+        start, end, promotion = unpack_move(move)
+        # spicy logic here but as pawns can't go backwards, should be fine
+        if not promotion and (new_position.squares[start] & KIND_MASK) - 1 == PIECE_ID.pawn and (end >> 3 == 7 or end >> 3 == 0):
+            promotion = make_pawn_choice()
+        new_position.make_move(start, end, promotion or PIECE_ID.queen)
         return new_position
     
     @classmethod
     def always_promote_queen(cls):
         return PIECE_ID.queen
+
+    # switch the move generation backend at runtime
+    # "checker" is the default MoveMaker + check_move pipeline
+    @classmethod
+    def set_move_generator(cls, name : str):
+        if name == "checker":
+            cls.move_generator = None
+        elif name == "bitboard":
+            from bitboard import BitboardGenerator
+            cls.move_generator = BitboardGenerator
+        else:
+            raise ValueError(f"Unknown move generator {name}.")
+
+    # opens the opening book at path, or drops the current one when path is None
+    @classmethod
+    def set_book(cls, path : Union[str, None]):
+        if cls.book is not None:
+            cls.book.close()
+            cls.book = None
+        if path is not None:
+            from book import OpeningBook
+            cls.book = OpeningBook(path)
+
+    # a legal book move for the position, or 0 when it's out of book
+    # picks moves weighted by how often they were played when rng is given,
+    # otherwise always the most played one
+    @classmethod
+    def book_move(cls, position : Position, rng : Union[random.Random, None] = None) -> int:
+        if cls.book is None:
+            return 0
+        book_moves = cls.book.lookup(position.key)
+        if not book_moves:
+            return 0
+        legal = cls.generate_legal_moves(position, position.black_to_move)
+        # keys can collide, so only trust moves that are legal here
+        book_moves = [book_move for book_move in book_moves if book_move.move in legal]
+        if not book_moves:
+            return 0
+        if rng is None:
+            return book_moves[0].move
+        return rng.choices(book_moves, weights=[book_move.games for book_move in book_moves])[0].move
+
+    # opens the tablebases in directory, or drops the current ones when directory is None
+    @classmethod
+    def set_tablebases(cls, directory : Union[str, None]):
+        if cls.tablebases is not None:
+            cls.tablebases.close()
+            cls.tablebases = None
+        if directory is not None:
+            from tablebase import Tablebases
+            cls.tablebases = Tablebases(directory)
+
+    # the tablebase move for the position, or 0 when it isn't covered
+    @classmethod
+    def tablebase_move(cls, position : Position) -> int:
+        if cls.tablebases is None:
+            return 0
+        return cls.tablebases.best_move(position)
+
+    # lazily yields the legal moves for the current player as packed moves
+    # pawn promotions yield one move per promotion choice
+    @classmethod
+    def iter_legal_moves(cls, position : Position, black_to_move : bool):
+        if cls.move_generator is not None:
+            yield from cls.move_generator.iter_legal_moves(position, black_to_move)
+            return
+        team_bit = BLACK_BIT if black_to_move else 0
+        legality = LegalityChecker(position, black_to_move)
+        for square, code in enumerate(position.squares):
+            if not code or (code & BLACK_BIT) != team_bit:
+                continue
+            promoting = (code & KIND_MASK) - 1 == PIECE_ID.pawn
+            for move in MoveMaker.make_possible_moves(position, Piece.from_code(code, square)):
+                end = (move >> 6) & 63
+                if not cls.check_move(position, square, end, black_to_move, legality):
+                    continue
+                if promoting and (end >> 3 == 7 or end >> 3 == 0):
+                    for choice in PROMOTION_CHOICES:
+                        yield move | (choice << 12)
+                else:
+                    yield move
+
+    # generates all legal moves for the current player as packed moves
+    @classmethod
+    def generate_legal_moves(cls, position : Position, black_to_move : bool) -> array:
+        if cls.move_generator is not None:
+            return cls.move_generator.legal_moves(position, black_to_move)
+        return array('H', cls.iter_legal_moves(position, black_to_move))
+
+    # stops at the first legal move; False means the player is mated or stalemated
+    @classmethod
+    def has_legal_move(cls, position : Position, black_to_move : bool) -> bool:
+        for _ in cls.iter_legal_moves(position, black_to_move):
+            return True
+        return False
+
+    # counts legal moves, stopping once limit is reached if one is given
+    @classmethod
+    def count_legal_moves(cls, position : Position, black_to_move : bool, limit : Union[int, None] = None) -> int:
+        count = 0
+        for _ in cls.iter_legal_moves(position, black_to_move):
+            count += 1
+            if count == limit:
+                break
+        return count
+
     # generates all possible possitions for current player to move to
     # helpful for AI
     # if this returns 0 positions, it means that the player whose turn it is has been mated
     @classmethod
     def generate_next_positions(cls, position : Position, black_to_move : bool):
-        pieces : list[Piece] = position.pieces
-        pieces_to_move = filter(lambda piece : piece.is_black == black_to_move, pieces)
-        moves = []
-        for piece in pieces_to_move:
-            moves.extend(MoveMaker.make_possible_moves(position, piece))
-        valid_moves = filter(lambda move : cls.check_move(position, move[0], move[1], black_to_move), moves)
         next_positions = []
-        for move in valid_moves:
-            next_positions.append(cls.new_position_from_move(position, move[0], move[1], cls.always_promote_queen))
+        for move in cls.generate_legal_moves(position, black_to_move):
+            new_position = position.copy()
+            new_position.make_move(*unpack_move(move))
+            next_positions.append(new_position)
         return next_positions
 
-    def try_move(self, start_position : str, end_position : str):
-        valid = Game.check_move(self.current_position, start_position, end_position, self.black_to_move)
-        if not valid:
-            return
-        self.current_position = Game.new_position_from_move(self.current_position, start_position, end_position, self.pawn_choice)
-        self.prev_moves.append(f"{start_position} {end_position}")
-        checks = CheckChecker.check_check(self.current_position)
-        if checks[0] or checks[1]:
-            team = "Black" if checks[0] else "White"
+    # the legal moves of the position to move, generated on the first call each ply
+    def legal_moves(self) -> tuple[int, ...]:
+        if self.ply_moves is None:
+            self.cache_ply(Game.generate_legal_moves(self.current_position, self.black_to_move))
+        return self.ply_moves
+
+    def is_legal_move(self, move : int) -> bool:
+        self.legal_moves()
+        return move in self.ply_move_set
+
+    def in_check(self) -> bool:
+        if self.ply_check is None:
+            self.ply_check = is_in_check(self.current_position, self.black_to_move)
+        return self.ply_check
+
+    # "checkmate" or "stalemate" when the side to move has no legal move, otherwise ""
+    def status(self) -> str:
+        if self.legal_moves():
+            return ""
+        return "checkmate" if self.in_check() else "stalemate"
+
+    # fills the cache for this ply with moves, and the check status if known,
+    # worked out elsewhere, e.g. by a worker process
+    def cache_ply(self, moves : Iterable[int], check : Union[bool, None] = None):
+        self.ply_moves = tuple(moves)
+        self.ply_move_set = frozenset(self.ply_moves)
+        self.ply_check = check
+
+    # drops the cache, whenever the position to move changes
+    def invalidate(self):
+        self.ply_moves = None
+        self.ply_move_set = None
+        self.ply_check = None
+
+    # validates and plays a packed move, returning whether it was valid
+    # pawn_choice is only asked when a pawn promotes and move doesn't name the piece
+    def try_move(self, move : int) -> bool:
+        start, end, promotion = unpack_move(move)
+        promoting = (self.current_position.squares[start] & KIND_MASK) - 1 == PIECE_ID.pawn and (end >> 3 == 7 or end >> 3 == 0)
+        # promotions are in the legal set once per piece, so check the move
+        # itself before asking which piece to promote to
+        if not self.is_legal_move(pack_move(start, end, PIECE_ID.queen if promoting else 0)):
+            if DEBUG:
+                # only to explain the rejection
+                Game.check_move(self.current_position, start, end, self.black_to_move)
+            return False
+        if promoting:
+            move = pack_move(start, end, promotion or self.pawn_choice())
+            if not self.is_legal_move(move):
+                return False
+        else:
+            move = pack_move(start, end)
+        self.apply_move(move)
+        # only the side now to move can be in check
+        if self.verbose and self.in_check():
+            team = "Black" if self.black_to_move else "White"
             print(f"{team} is in check!")
-        # for checkmate, need to generate all possible next moves for defending team and see if any escape check
+        return True
+
+    # plays a packed move that is already known to be legal, without validation
+    def apply_move(self, move : int):
+        start, end, promotion = unpack_move(move)
+        new_position = self.current_position.copy()
+        new_position.make_move(start, end, promotion or PIECE_ID.queen)
+        self.current_position = new_position
+        self.prev_moves.append(move)
         self.black_to_move = not self.black_to_move
-        
+        self.invalidate()
 
+
+    # legality can be passed in to share one LegalityChecker across every move
+    # from the same position
     @classmethod
-    def check_move(cls, board : Position, start_position : str, end_position : str, black_to_move : bool):
-        piece_positions = board.get_piece_positions()
-        piece = piece_positions.get(start_position)
+    def check_move(cls, board : Position, start : int, end : int, black_to_move : bool, legality : Union[LegalityChecker, None] = None):
+        piece = board.piece_at(start) if 0 <= start < 64 else None
         # check that there's a piece where we want to move
         if piece is None:
             d_print("There's no piece in that square.")
@@ -561,28 +1267,35 @@ class Game():
             d_print("This is not your piece to move.")
             return False
         # check that the move's not invalid for the piece
-        if not MoveStrategyChecker.check_move(piece, end_position):
+        if not MoveStrategyChecker.check_move(piece, end):
             d_print("That's not a valid move for that piece.")
             return False
         # check that there's no obstructions for the move
-        if not PieceChecker.check_move(board, piece, end_position, black_to_move):
+        if not PieceChecker.check_move(board, piece, end, black_to_move):
             d_print("This move is obstructed by another piece.")
             return False
+        if legality is None:
+            legality = LegalityChecker(board, black_to_move)
         if piece.piece_id == PIECE_ID.king:
-            if not PieceChecker.check_castling(board, start_position, end_position, black_to_move):
+            if not PieceChecker.check_castling(board, start, end, black_to_move, legality.attacked):
                 return False
         # check that the move doesn't reveal or maintain check for player moving
-        new_position = Game.new_position_from_move(board, start_position, end_position, cls.always_promote_queen)
-        in_check = CheckChecker.check_check(new_position)
-        # reversed because black_to_move is the PREVIOUS state of the board
-        if (black_to_move and in_check[0]) or (not black_to_move and in_check[1]):
+        if not legality.is_legal(start, end):
             d_print("This move would reveal or maintain check against your king!")
             return False
         return True
 
     def setup(self):
-        self.current_position = self.start_position()
-        self.black_to_move = False
+        if self.start_fen is not None:
+            self.current_position = Position.from_fen(self.start_fen)
+        else:
+            self.current_position = self.start_position()
+        self.black_to_move = self.current_position.black_to_move
+        self.prev_moves = array('H')
+        self.invalidate()
+
+    def to_fen(self) -> str:
+        return self.current_position.to_fen()
 
     def render(self):
         if self.black_to_move:
@@ -631,52 +1344,109 @@ def pawn_choice():
 
 def main():
     parser = argparse.ArgumentParser(description="Python Chess game.")
-    parser.add_argument('--store', help="Store the list of moves at the given path.")
+    parser.add_argument('--store', help="Log the moves to the given path as they're made.")
     parser.add_argument('--load', help="Load the list of moves at the given path.")
+    parser.add_argument('--generator', choices=["checker", "bitboard"], default="checker", help="Move generation backend.")
+    parser.add_argument('--perft', type=int, metavar="DEPTH", help="Count the leaf nodes of the move tree to the given depth, with divide output.")
+    parser.add_argument('--perft-suite', type=int, metavar="DEPTH", help="Check move generation against the reference perft counts up to the given depth.")
+    parser.add_argument('--fen', help="FEN of the position to play or run perft from.")
+    parser.add_argument('--replay', nargs="+", metavar="PATH", help="Quietly replay every game in the given JSON lines or --store files.")
+    parser.add_argument('--trusted', action="store_true", help="Skip legality checks when replaying.")
+    parser.add_argument('--uci', action="store_true", help="Run as a UCI engine over stdin and stdout.")
+    parser.add_argument('--profile', nargs="?", const="", metavar="PATH", help="Time the hot functions and print a report at exit, also written as JSON to PATH if given.")
+    parser.add_argument('--profile-stacks', metavar="PATH", help="With --profile, write collapsed stacks for flame graphs to PATH.")
     args = vars(parser.parse_args())
 
-    renderer = PositionRenderer(darkmode=True)
-    game = Game(renderer, pawn_choice)
+    if args.get("profile") is not None:
+        import instrument
+        instrument.install(args["profile"], args.get("profile_stacks"))
 
-    # normal start
-    preprocess_list = []
+    Game.set_move_generator(args["generator"])
+
+    if args.get("perft") is not None or args.get("perft_suite") is not None:
+        if any(args.get(name) is not None and args[name] < 1 for name in ("perft", "perft_suite")):
+            parser.error("perft depth must be at least 1")
+        from perft import START_FEN, run_perft, run_suite
+        if args.get("perft_suite") is not None:
+            passed = run_suite(args["perft_suite"])
+        else:
+            passed = run_perft(args.get("fen") or START_FEN, args["perft"])
+        raise SystemExit(0 if passed else 1)
+
+    if args["uci"]:
+        from uci import run_uci
+        run_uci()
+        return
+
+    if args.get("replay") is not None:
+        from replay import run_replay
+        raise SystemExit(0 if run_replay(args["replay"], args["trusted"]) else 1)
+
+    renderer = PositionRenderer(darkmode=True)
+    game = Game(renderer, pawn_choice, fen=args.get("fen"))
 
     store_path = args.get("store")
     load_path = args.get("load")
     if load_path != None:
-        with open(load_path,  "r") as f:
-            all_lines = "\n".join(f.readlines())
-            preprocess_list = json.loads(all_lines)
+        from replay import ReplayError, iter_games, replay_game
+        try:
+            # only the first game in the file is loaded
+            moves = next(iter_games([load_path]), None)
+        except ReplayError as error:
+            print(f"Could not load {load_path}: {error}")
+            moves = None
+        if moves is not None:
+            try:
+                for _ in replay_game(game, moves):
+                    pass
+            except ReplayError as error:
+                # the game was left part way through the bad move's position,
+                # so replay the moves before it to get back to a consistent state
+                print(f"Stopped loading {load_path}: {error}")
+                for _ in replay_game(game, moves[:error.ply - 1]):
+                    pass
 
-    for move in preprocess_list:
-        move_split = move.split(" ")
-        game.try_move(move_split[0], move_split[1])
+    move_log = None
+    if store_path != None:
+        from archive import MoveLog
+        move_log = MoveLog(store_path)
+        move_log.update(game.prev_moves)
 
     while True:
         game.render()
 
-        next_moves = Game.generate_next_positions(game.current_position, game.black_to_move)
-        checks = CheckChecker.check_check(game.current_position)
-        if len(next_moves) == 0:
-            if checks[0] or checks[1]:
-                team = "Black" if checks[0] else "White"
+        status = game.status()
+        if status:
+            if status == "checkmate":
+                team = "Black" if game.black_to_move else "White"
                 print(f"{team} has been mated! Wait 5s to restart.")
-                sleep(5)
-                game.setup()
-                game.render()
+            else:
+                print("Stalemate! Wait 5s to restart.")
+            sleep(5)
+            game.setup()
+            game.render()
 
         move = input('> ')
         if move in ["quit", "exit", "q"]:
+            if move_log != None:
+                move_log.close()
             break
-        move_split = move.upper().split(" ")
-
-        if len(move_split) == 2:
-            game.try_move(move_split[0], move_split[1])
+        try:
+            game.try_move(string_to_move(move))
+        except ValueError:
+            d_print("Moves are written like E2 E4, or E7 E8 Q to promote.")
         
-        # store after each move
-        if store_path != None:
-            with open(store_path, "w") as f:
-                json.dump(game.prev_moves, f)
+        # log each new move as it's made
+        if move_log != None:
+            move_log.update(game.prev_moves)
+
+# PYCHESS_PROFILE instruments every entry point that imports main, including
+# worker processes; only the imported module is patched, not a __main__ copy
+if __name__ == "main" and environ.get("PYCHESS_PROFILE"):
+    import instrument
+    instrument.install_from_env()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # run from the importable module so that backends importing main share its state
+    import main as pychess
+    pychess.main()
\ No newline at end of file
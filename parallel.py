@@ -0,0 +1,193 @@
+import argparse
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+from time import perf_counter
+from typing import Union
+
+from main import Game, Position
+from perft import START_FEN
+from search import MAX_PLY, Searcher, SearchResult, material_evaluation
+from transposition import BOUND, TranspositionTable
+
+# each entry is two 64 bit words: the key xored with the data, and the data
+# packing move (16 bits), score (32 bits, offset), depth + 1 (8 bits, 0 when
+# empty), bound (2 bits) and age (6 bits)
+# a reader only accepts an entry whose words xor back to its key, so an entry
+# torn by two processes writing at once just reads as a miss and no locks are needed
+SCORE_OFFSET = 1 << 31
+AGE_MASK = 0x3F
+
+def pack_entry(move : int, score : int, depth : int, bound : BOUND, age : int) -> int:
+    return move | (score + SCORE_OFFSET) << 16 | (depth + 1) << 48 | bound << 56 | (age & AGE_MASK) << 58
+
+class SharedTranspositionTable:
+    # the same interface as TranspositionTable, over a shared memory block that
+    # other processes open by name
+    def __init__(self, size : int = 1 << 20, name : Union[str, None] = None):
+        size = 1 << (max(size, 1).bit_length() - 1)
+        self.size = size
+        self.mask = size - 1
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=size * 16)
+            self.memory.buf[:size * 16] = bytes(size * 16)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        words = self.memory.buf[:size * 16].cast('Q')
+        self.words = words
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def new_search(self):
+        self.age = (self.age + 1) & AGE_MASK
+
+    def clear(self):
+        self.memory.buf[:self.size * 16] = bytes(self.size * 16)
+        self.age = 0
+        self.hits = self.misses = self.stores = self.evictions = 0
+
+    def probe(self, key : int) -> Union[tuple[int, int, BOUND, int], None]:
+        index = (key & self.mask) << 1
+        words = self.words
+        data = words[index + 1]
+        if not data >> 48 & 0xFF or words[index] ^ data != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (data & 0xFFFF, (data >> 16 & 0xFFFFFFFF) - SCORE_OFFSET, data >> 56 & 3, (data >> 48 & 0xFF) - 1)
+
+    # depth preferred replacement, as in TranspositionTable
+    def store(self, key : int, depth : int, score : int, bound : BOUND, move : int = 0):
+        index = (key & self.mask) << 1
+        words = self.words
+        data = words[index + 1]
+        if data >> 48 & 0xFF:
+            same_key = words[index] ^ data == key
+            if not same_key and (data >> 58) == self.age and depth < (data >> 48 & 0xFF) - 1:
+                return
+            if not same_key:
+                self.evictions += 1
+            elif move == 0:
+                move = data & 0xFFFF
+        data = pack_entry(move, score, min(depth, 126), bound, self.age)
+        words[index] = key ^ data
+        words[index + 1] = data
+        self.stores += 1
+
+    def hashfull(self) -> int:
+        sample = min(self.size, 1000)
+        used = sum(1 for index in range(sample) if self.words[index * 2 + 1])
+        return used * 1000 // sample
+
+    def close(self):
+        self.words.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+# state of each pool worker, set up once by init_worker
+worker_table = None
+worker_stop = None
+
+def init_worker(name : str, size : int, stop_event, generator : str):
+    global worker_table, worker_stop
+    Game.set_move_generator(generator)
+    worker_table = SharedTranspositionTable(size, name)
+    worker_stop = stop_event
+
+# a lazy SMP helper: searches the same root sharing the table, until the main
+# search sets the stop event; odd helpers aim a ply deeper so that the
+# helpers don't all work through the same tree in step
+def helper_search(position : Position, max_depth : int, helper : int, age : int, evaluate = material_evaluation) -> int:
+    searcher = Searcher(evaluate, worker_table)
+    searcher.stop_event = worker_stop
+    # keep the table's age in step with the main search so entries aren't seen as stale
+    worker_table.age = age - 1
+    result = searcher.search(position, min(max_depth + helper % 2, MAX_PLY - 1))
+    return result.nodes
+
+class ParallelSearcher:
+    # workers counts the helper processes; the main search runs in this process
+    def __init__(self, workers : Union[int, None] = None, table_size : int = 1 << 20, evaluate = material_evaluation,
+            generator : str = "bitboard"):
+        self.workers = workers if workers is not None else max((os.cpu_count() or 1) - 1, 1)
+        self.evaluate = evaluate
+        self.table = SharedTranspositionTable(table_size)
+        self.stop_event = multiprocessing.Event()
+        self.searcher = Searcher(evaluate, self.table)
+        self.pool = multiprocessing.Pool(self.workers, initializer=init_worker,
+            initargs=(self.table.name, self.table.size, self.stop_event, generator))
+        # nodes searched by the helpers during the last search
+        self.helper_nodes = 0
+
+    def search(self, position : Position, max_depth : int = 64, time_limit : Union[float, None] = None,
+            node_limit : Union[int, None] = None, on_iteration = None) -> SearchResult:
+        self.stop_event.clear()
+        # the main searcher bumps the age in search, helpers copy it
+        age = (self.table.age + 1) & 0x3F
+        helpers = [self.pool.apply_async(helper_search, (position, max_depth, helper, age, self.evaluate))
+            for helper in range(self.workers)]
+        result = self.searcher.search(position, max_depth, time_limit, node_limit, on_iteration)
+        self.stop_event.set()
+        self.helper_nodes = sum(helper.get() for helper in helpers)
+        return result
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# runs the same fixed depth search in one process and across workers, and
+# reports the speedup and how many extra nodes the parallel search visited
+def compare(position : Position, depth : int, workers : int, table_size : int = 1 << 20) -> dict:
+    single = Searcher(material_evaluation, TranspositionTable(table_size))
+    started = perf_counter()
+    single_result = single.search(position, depth)
+    single_time = perf_counter() - started
+
+    with ParallelSearcher(workers, table_size) as parallel:
+        started = perf_counter()
+        parallel_result = parallel.search(position, depth)
+        parallel_time = perf_counter() - started
+        parallel_nodes = parallel_result.nodes + parallel.helper_nodes
+    return {
+        "depth": depth,
+        "workers": workers,
+        "single_time": single_time,
+        "single_nodes": single_result.nodes,
+        "parallel_time": parallel_time,
+        "parallel_nodes": parallel_nodes,
+        "speedup": single_time / parallel_time if parallel_time > 0 else 0,
+        "overhead": parallel_nodes / single_result.nodes - 1 if single_result.nodes else 0,
+        "same_move": single_result.best_move == parallel_result.best_move,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the lazy SMP parallel search against a single process search.")
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--workers', type=int, help="Helper processes, defaults to one less than the number of cores.")
+    parser.add_argument('--fen', default=START_FEN)
+    parser.add_argument('--generator', choices=["checker", "bitboard"], default="bitboard", help="Move generation backend.")
+    args = parser.parse_args()
+
+    Game.set_move_generator(args.generator)
+    workers = args.workers if args.workers is not None else max((os.cpu_count() or 1) - 1, 1)
+    stats = compare(Position.from_fen(args.fen), args.depth, workers)
+    print(f"single: {stats['single_nodes']} nodes in {stats['single_time']:.2f}s")
+    print(f"parallel ({stats['workers']} helpers): {stats['parallel_nodes']} nodes in {stats['parallel_time']:.2f}s")
+    print(f"speedup {stats['speedup']:.2f}x, search overhead {stats['overhead'] * 100:.0f}%,"
+        f" {'same' if stats['same_move'] else 'different'} best move")
+
+if __name__ == "__main__":
+    main()
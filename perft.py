@@ -0,0 +1,103 @@
+from time import perf_counter
+
+from main import Game, Position, move_to_string, unpack_move
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# reference leaf counts by depth (starting at depth 1) for the standard perft
+# positions, see https://www.chessprogramming.org/Perft_Results
+PERFT_SUITE = {
+    "start": (START_FEN, [20, 400, 8902, 197281, 4865609, 119060324]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603, 193690690]),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624, 11030083]),
+    "position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333, 15833292]),
+    "position5": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487, 89941194]),
+    "position6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594, 164075551]),
+    # regressions: en passant fields with no pawn to take, which FEN parsing
+    # has to drop, and one that is real; counts agree across both backends
+    "ep_own_piece": ("4k3/8/8/8/8/8/3PB3/4K3 w - e3 0 1", [14, 66, 930, 5647]),
+    "ep_not_pawn": ("4k3/8/8/3Pn3/8/8/8/4K3 w - e6 0 1", [6, 77, 524, 6239]),
+    "ep_capture": ("4k3/8/8/3Pp3/8/8/8/4K3 w - e6 0 1", [7, 38, 276, 1799]),
+}
+
+# counts the leaf nodes of the legal move tree down to depth
+# moves come from Game.generate_legal_moves and are applied with make/unmake
+def perft(position : Position, depth : int) -> int:
+    if depth <= 0:
+        return 1
+    moves = Game.generate_legal_moves(position, position.black_to_move)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        position.make_move(*unpack_move(move))
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+# leaf counts below each root move, none below depth 1
+def divide(position : Position, depth : int) -> list[tuple[int, int]]:
+    counts = []
+    if depth <= 0:
+        return counts
+    for move in Game.generate_legal_moves(position, position.black_to_move):
+        position.make_move(*unpack_move(move))
+        counts.append((move, perft(position, depth - 1)))
+        position.unmake_move()
+    return counts
+
+def find_reference(fen : str) -> tuple[str, list[int]]:
+    board = " ".join(fen.split()[:4])
+    for name, (suite_fen, counts) in PERFT_SUITE.items():
+        if " ".join(suite_fen.split()[:4]) == board:
+            return name, counts
+    return None, []
+
+# prints divide output, the total and nodes per second, and checks the total
+# against the reference table when the position is in it
+def run_perft(fen : str, depth : int, show_divide : bool = True) -> bool:
+    position = Position.from_fen(fen)
+    started = perf_counter()
+    counts = divide(position, depth)
+    elapsed = perf_counter() - started
+    total = sum(nodes for _, nodes in counts)
+    if show_divide:
+        for move, nodes in sorted(counts, key=lambda count: move_to_string(count[0])):
+            print(f"{move_to_string(move)}: {nodes}")
+        print()
+    print(f"Nodes: {total}")
+    print(f"Time: {elapsed:.3f}s ({total / elapsed if elapsed > 0 else 0:.0f} nodes/s)")
+    name, expected = find_reference(fen)
+    if name is None or depth > len(expected):
+        return True
+    passed = expected[depth - 1] == total
+    print(f"Expected {expected[depth - 1]} for {name}: {'OK' if passed else 'MISMATCH'}")
+    return passed
+
+# checks every reference position up to max_depth, skipping any depth with
+# more than max_nodes expected leaves so that slow backends finish
+def run_suite(max_depth : int, max_nodes : int = 1000000) -> bool:
+    all_passed = True
+    total_nodes = 0
+    started = perf_counter()
+    for name, (fen, expected) in PERFT_SUITE.items():
+        for depth, count in enumerate(expected[:max_depth], start=1):
+            if count > max_nodes:
+                break
+            position = Position.from_fen(fen)
+            depth_started = perf_counter()
+            nodes = perft(position, depth)
+            elapsed = perf_counter() - depth_started
+            total_nodes += nodes
+            passed = nodes == count
+            all_passed = all_passed and passed
+            print(f"{name} depth {depth}: {nodes} / {count} {'OK' if passed else 'MISMATCH'}"
+                f" ({nodes / elapsed if elapsed > 0 else 0:.0f} nodes/s)")
+    elapsed = perf_counter() - started
+    print(f"Total: {total_nodes} nodes in {elapsed:.3f}s ({total_nodes / elapsed if elapsed > 0 else 0:.0f} nodes/s)")
+    return all_passed
@@ -0,0 +1,148 @@
+import json
+from array import array
+from time import perf_counter
+from typing import Iterable, Sequence, Union
+
+from archive import GameArchive, MoveLog, is_archive
+from main import Game, PIECE_ID, move_to_string, string_to_move, unpack_move
+
+# ply is the 1 based ply of the bad move, when the error is about one
+class ReplayError(ValueError):
+    def __init__(self, message : str, ply : Union[int, None] = None):
+        super().__init__(message)
+        self.ply = ply
+
+# yields the JSON values in text, which may be separated by whitespace
+def iter_json_values(decoder : json.JSONDecoder, text : str):
+    index = 0
+    end = len(text)
+    while True:
+        # skip whitespace between values
+        while index < end and text[index].isspace():
+            index += 1
+        if index == end:
+            break
+        value, index = decoder.raw_decode(text, index)
+        yield value
+
+# yields every game in the given files, in order, as a dict holding at least
+# its moves; files can be
+# - JSON lines, with one move list or self-play record per line
+# - --store files holding a JSON list, possibly several concatenated
+# - move logs written by --store, one move per line
+# - binary game archives, whose moves come back packed
+# JSON that doesn't decode yields a record with an "error" message instead,
+# so that one bad line doesn't end the files after it
+def iter_records(paths : Iterable[str]):
+    decoder = json.JSONDecoder()
+    for path in paths:
+        if is_archive(path):
+            with GameArchive(path) as archive:
+                for result, moves in archive.iter_games():
+                    # copied and released before yielding, so that nothing points
+                    # into the mapping if the consumer stops early and it's closed
+                    packed = array('H', moves)
+                    if isinstance(moves, memoryview):
+                        moves.release()
+                    yield { "moves": packed, "result": result }
+            continue
+        with open(path, "r") as f:
+            first = f.read(1)
+            while first.isspace():
+                first = f.read(1)
+            f.seek(0)
+            if first and first not in "[{":
+                yield { "moves": MoveLog.read(path) }
+                continue
+            yielded = False
+            for number, line in enumerate(f, start=1):
+                try:
+                    for record in iter_json_values(decoder, line):
+                        yielded = True
+                        yield record if isinstance(record, dict) else { "moves": record }
+                except json.JSONDecodeError as error:
+                    if first == "[" and not yielded:
+                        # a list spread over several lines, as pretty printers write them
+                        break
+                    yield { "error": f"{path} line {number}: {error.msg}." }
+            else:
+                continue
+            f.seek(0)
+            try:
+                for record in iter_json_values(decoder, f.read()):
+                    yield record if isinstance(record, dict) else { "moves": record }
+            except json.JSONDecodeError as error:
+                yield { "error": f"{path} line {error.lineno}: {error.msg}." }
+
+# yields the move list of every game in the given files, raising
+# ReplayError at the first record that didn't decode
+def iter_games(paths : Iterable[str]):
+    for record in iter_records(paths):
+        if "error" in record:
+            raise ReplayError(record["error"])
+        yield record["moves"]
+
+# plays a game's moves, as strings or packed moves, on game from the start position without printing
+# yields a copy of the position after every ply when per_ply is set, otherwise
+# only the final position, which stays owned by game and changes on its next replay
+# trusted skips validating each move with Game.check_move, which is only
+# safe for lists we wrote ourselves
+def replay_game(game : Game, moves : Sequence[Union[str, int]], trusted : bool = False, per_ply : bool = False):
+    game.setup()
+    position = game.current_position
+    played = array('H')
+    for ply, text in enumerate(moves):
+        try:
+            move = string_to_move(text) if isinstance(text, str) else text
+        except ValueError as error:
+            raise ReplayError(f"Ply {ply + 1}: {error}", ply + 1)
+        start, end, promotion = unpack_move(move)
+        if not trusted and not Game.check_move(position, start, end, position.black_to_move):
+            raise ReplayError(f"Ply {ply + 1}: illegal move {move_to_string(move)}.", ply + 1)
+        position.make_move(start, end, promotion or PIECE_ID.queen)
+        played.append(move)
+        if per_ply:
+            yield position.copy()
+    game.black_to_move = position.black_to_move
+    # the position was played on in place, so nothing cached for it holds
+    game.invalidate()
+    game.prev_moves = played
+    if not per_ply:
+        yield position
+
+# streams every game in paths through one reusable game, yielding
+# (game number, position) for the final or every per ply position
+# invalid games are skipped and counted in stats when given, or raise otherwise
+def replay_games(paths : Iterable[str], trusted : bool = False, per_ply : bool = False, stats : Union[dict, None] = None):
+    game = Game(verbose=False)
+    for number, record in enumerate(iter_records(paths)):
+        if "error" in record:
+            if stats is None:
+                raise ReplayError(f"Game {number + 1}: {record['error']}")
+            stats["invalid"] += 1
+            continue
+        moves = record["moves"]
+        try:
+            for position in replay_game(game, moves, trusted, per_ply):
+                yield number, position
+        except ReplayError as error:
+            if stats is None:
+                raise ReplayError(f"Game {number + 1}: {error}")
+            stats["invalid"] += 1
+            continue
+        if stats is not None:
+            stats["games"] += 1
+            stats["plies"] += len(moves)
+
+# replays every game and prints totals, returning whether all games were valid
+def run_replay(paths : list[str], trusted : bool = False) -> bool:
+    stats = { "games": 0, "plies": 0, "invalid": 0 }
+    started = perf_counter()
+    for _ in replay_games(paths, trusted, stats=stats):
+        pass
+    elapsed = perf_counter() - started
+    print(f"Replayed {stats['games']} games, {stats['plies']} plies in {elapsed:.3f}s"
+        f" ({stats['plies'] / elapsed if elapsed > 0 else 0:.0f} plies/s)")
+    if stats["invalid"]:
+        print(f"Skipped {stats['invalid']} invalid games.")
+    return stats["invalid"] == 0
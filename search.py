@@ -0,0 +1,289 @@
+from time import perf_counter
+from typing import Union, Callable
+
+from main import (
+    Game, Position, PIECE_ID, KIND_MASK, BLACK_BIT, is_in_check, unpack_move
+)
+from transposition import TranspositionTable, BOUND
+
+MATE = 100000
+INFINITY = 1000000
+MAX_PLY = 128
+# how far back to look for repeated positions
+REPETITION_WINDOW = 16
+
+# centipawn values indexed by PIECE_ID
+PIECE_VALUES = (0, 900, 500, 330, 320, 100)
+# attacker values for MVV-LVA, where the king is the least attractive attacker
+ATTACKER_VALUES = (1000, 900, 500, 330, 320, 100)
+
+# ordering scores, so that the hash move comes first, then captures, killers and
+# finally quiet moves by history
+HASH_MOVE_SCORE = 10000000
+CAPTURE_SCORE = 1000000
+KILLER_SCORES = (900000, 800000)
+
+# default evaluation: material balance from white's point of view
+def material_evaluation(position : Position) -> int:
+    score = 0
+    for code in position.squares:
+        if code:
+            value = PIECE_VALUES[(code & KIND_MASK) - 1]
+            score += -value if code & BLACK_BIT else value
+    return score
+
+class SearchAborted(Exception):
+    pass
+
+class SearchResult:
+    __slots__ = ("best_move", "score", "depth", "pv", "nodes", "time", "nps", "branching_factor")
+
+    def __init__(self):
+        self.best_move = 0
+        self.score = 0
+        self.depth = 0
+        self.pv = []
+        self.nodes = 0
+        self.time = 0.0
+        self.nps = 0
+        # nodes of the last completed iteration over nodes of the one before
+        self.branching_factor = 0.0
+
+class Searcher:
+    # evaluate is any callable scoring a position from white's point of view
+    def __init__(self, evaluate : Callable[[Position], int] = material_evaluation, table : Union[TranspositionTable, None] = None):
+        self.evaluate = evaluate
+        self.table = table
+        self.stopped = False
+        # anything with is_set(), such as a multiprocessing.Event, that stops
+        # the search from outside this process
+        self.stop_event = None
+        self.nodes = 0
+        self.node_limit = None
+        self.deadline = None
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.history = [0] * (64 * 64)
+        self.pv = [[0] * MAX_PLY for _ in range(MAX_PLY)]
+        self.pv_length = [0] * MAX_PLY
+
+    # asks a running search to return its last completed iteration
+    def stop(self):
+        self.stopped = True
+
+    # iterative deepening up to max_depth or until the time or node budget runs
+    # out; on_iteration is called with the result of every completed depth
+    def search(self, position : Position, max_depth : int = 64, time_limit : Union[float, None] = None,
+            node_limit : Union[int, None] = None, on_iteration : Union[Callable[[SearchResult], None], None] = None) -> SearchResult:
+        root = position.copy()
+        root.key_history.extend(position.key_history)
+        self.stopped = False
+        self.nodes = 0
+        self.node_limit = node_limit
+        started = perf_counter()
+        self.deadline = started + time_limit if time_limit is not None else None
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.history = [0] * (64 * 64)
+        if self.table is not None:
+            self.table.new_search()
+
+        result = SearchResult()
+        previous_nodes = 0
+        for depth in range(1, min(max_depth, MAX_PLY - 1) + 1):
+            iteration_start = self.nodes
+            try:
+                score = self.negamax(root, depth, -INFINITY, INFINITY, 0)
+            except SearchAborted:
+                # put the root back together after unwinding mid search
+                while len(root.undo) > 0:
+                    root.unmake_move()
+                break
+            iteration_nodes = self.nodes - iteration_start
+            result.depth = depth
+            result.score = score
+            result.pv = self.pv[0][:self.pv_length[0]]
+            result.best_move = result.pv[0] if result.pv else 0
+            result.branching_factor = iteration_nodes / previous_nodes if previous_nodes else 0.0
+            previous_nodes = iteration_nodes
+            self.fill_stats(result, started)
+            if on_iteration is not None:
+                on_iteration(result)
+            # no legal moves or a forced mate found, deeper won't change anything
+            if not result.pv or abs(score) >= MATE - MAX_PLY:
+                break
+        self.fill_stats(result, started)
+        return result
+
+    def fill_stats(self, result : SearchResult, started : float):
+        result.nodes = self.nodes
+        result.time = perf_counter() - started
+        result.nps = int(self.nodes / result.time) if result.time > 0 else 0
+
+    def check_limits(self):
+        if self.stopped or (self.stop_event is not None and self.stop_event.is_set()):
+            raise SearchAborted()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted()
+        if self.deadline is not None and perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+    def score_position(self, position : Position) -> int:
+        score = self.evaluate(position)
+        return -score if position.black_to_move else score
+
+    @classmethod
+    def is_repetition(cls, position : Position) -> bool:
+        history = position.key_history
+        key = position.key
+        lowest = max(len(history) - REPETITION_WINDOW, 0)
+        for index in range(len(history) - 2, lowest - 1, -2):
+            if history[index] == key:
+                return True
+        return False
+
+    @classmethod
+    def is_capture(cls, position : Position, move : int) -> bool:
+        end = (move >> 6) & 63
+        if position.squares[end]:
+            return True
+        start = move & 63
+        return end == position.ep_square and (position.squares[start] & KIND_MASK) - 1 == PIECE_ID.pawn and (start ^ end) & 7 != 0
+
+    def order_moves(self, position : Position, moves, hash_move : int, ply : int) -> list[int]:
+        squares = position.squares
+        killers = self.killers[ply]
+        history = self.history
+        scored = []
+        for move in moves:
+            start, end, promotion = unpack_move(move)
+            if move == hash_move:
+                score = HASH_MOVE_SCORE
+            elif self.is_capture(position, move):
+                victim = squares[end]
+                victim_value = PIECE_VALUES[(victim & KIND_MASK) - 1] if victim else PIECE_VALUES[PIECE_ID.pawn]
+                score = CAPTURE_SCORE + victim_value * 10 - ATTACKER_VALUES[(squares[start] & KIND_MASK) - 1] // 10
+            elif move == killers[0]:
+                score = KILLER_SCORES[0]
+            elif move == killers[1]:
+                score = KILLER_SCORES[1]
+            else:
+                score = history[start * 64 + end]
+            if promotion and (squares[start] & KIND_MASK) - 1 == PIECE_ID.pawn and (end >> 3 == 7 or end >> 3 == 0):
+                score += CAPTURE_SCORE + PIECE_VALUES[promotion]
+            scored.append((score, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    # mate scores are stored relative to the node, not the root
+    @classmethod
+    def score_to_table(cls, score : int, ply : int) -> int:
+        if score >= MATE - MAX_PLY:
+            return score + ply
+        if score <= -MATE + MAX_PLY:
+            return score - ply
+        return score
+
+    @classmethod
+    def score_from_table(cls, score : int, ply : int) -> int:
+        if score >= MATE - MAX_PLY:
+            return score - ply
+        if score <= -MATE + MAX_PLY:
+            return score + ply
+        return score
+
+    def negamax(self, position : Position, depth : int, alpha : int, beta : int, ply : int) -> int:
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        self.pv_length[ply] = ply
+        if ply > 0 and self.is_repetition(position):
+            return 0
+        # tablebase hits are exact, scored like the mates the search finds itself
+        if ply > 0 and Game.tablebases is not None:
+            entry = Game.tablebases.probe(position)
+            if entry is not None:
+                result, plies = entry
+                return 0 if result == 0 else (MATE - ply - plies) * result
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self.quiescence(position, alpha, beta, ply)
+
+        original_alpha = alpha
+        hash_move = 0
+        table = self.table
+        if table is not None:
+            entry = table.probe(position.key)
+            if entry is not None:
+                hash_move, stored_score, bound, stored_depth = entry
+                if ply > 0 and stored_depth >= depth:
+                    stored_score = self.score_from_table(stored_score, ply)
+                    if bound == BOUND.exact:
+                        return stored_score
+                    if bound == BOUND.lower:
+                        alpha = max(alpha, stored_score)
+                    elif bound == BOUND.upper:
+                        beta = min(beta, stored_score)
+                    if alpha >= beta:
+                        return stored_score
+
+        black_to_move = position.black_to_move
+        moves = self.order_moves(position, Game.iter_legal_moves(position, black_to_move), hash_move, ply)
+        if not moves:
+            if is_in_check(position, black_to_move):
+                return -MATE + ply
+            return 0
+
+        best_score = -INFINITY
+        best_move = 0
+        pv = self.pv
+        for move in moves:
+            capture = self.is_capture(position, move)
+            position.make_move(*unpack_move(move))
+            score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    pv[ply][ply] = move
+                    child_length = self.pv_length[ply + 1]
+                    pv[ply][ply + 1:child_length] = pv[ply + 1][ply + 1:child_length]
+                    self.pv_length[ply] = child_length
+                    if alpha >= beta:
+                        if not capture:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[(move & 63) * 64 + ((move >> 6) & 63)] += depth * depth
+                        break
+
+        if table is not None:
+            if best_score <= original_alpha:
+                bound = BOUND.upper
+            elif best_score >= beta:
+                bound = BOUND.lower
+            else:
+                bound = BOUND.exact
+            table.store(position.key, depth, self.score_to_table(best_score, ply), bound, best_move)
+        return best_score
+
+    # searches captures only until the position is quiet
+    def quiescence(self, position : Position, alpha : int, beta : int, ply : int) -> int:
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        stand_pat = self.score_position(position)
+        if stand_pat >= beta or ply >= MAX_PLY - 1:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        captures = [move for move in Game.iter_legal_moves(position, position.black_to_move) if self.is_capture(position, move)]
+        for move in self.order_moves(position, captures, 0, ply):
+            position.make_move(*unpack_move(move))
+            score = -self.quiescence(position, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
@@ -0,0 +1,131 @@
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+from typing import Union
+
+from main import Game, PIECE_ID, KIND_MASK, is_in_check, move_to_string
+from agents import RandomAgent, make_agent
+
+RESULTS = ("1-0", "0-1", "1/2-1/2")
+
+# plays one game without any rendering or printing
+# the first opening_plies moves are random to spread the games out
+# returns the move list, result and reason, plus per position labels if asked
+def play_game(white, black, max_plies : int = 400, opening_plies : int = 0, seed : Union[int, None] = None, labels : bool = False) -> dict:
+    game = Game(verbose=False)
+    opening = RandomAgent(seed)
+    keys = { game.current_position.key: 1 }
+    positions = []
+    result, reason = "1/2-1/2", "max plies"
+    for ply in range(max_plies):
+        position = game.current_position
+        black_to_move = game.black_to_move
+        if not Game.has_legal_move(position, black_to_move):
+            if is_in_check(position, black_to_move):
+                result, reason = ("1-0" if black_to_move else "0-1"), "checkmate"
+            else:
+                result, reason = "1/2-1/2", "stalemate"
+            break
+        if all((code & KIND_MASK) - 1 == PIECE_ID.king for code in position.squares if code):
+            result, reason = "1/2-1/2", "insufficient material"
+            break
+        agent = opening if ply < opening_plies else (black if black_to_move else white)
+        move = agent(position, black_to_move)
+        if labels:
+            label = { "squares": position.squares.hex(), "black_to_move": black_to_move, "ep_square": position.ep_square }
+            last_result = getattr(agent, "last_result", None)
+            if last_result is not None:
+                # scores are from the point of view of the side to move
+                label["score"] = last_result.score
+            positions.append(label)
+        game.apply_move(move)
+        key = game.current_position.key
+        keys[key] = keys.get(key, 0) + 1
+        if keys[key] >= 3:
+            result, reason = "1/2-1/2", "repetition"
+            break
+    record = { "moves": [move_to_string(move) for move in game.prev_moves], "result": result, "reason": reason }
+    if labels:
+        record["positions"] = positions
+    return record
+
+# worker entry point: plays a shard of games and streams each one to its own
+# JSON lines file as soon as it finishes
+def play_shard(shard : int, first_game : int, games : int, out_dir : str, white : str, black : str, seed : int,
+        max_plies : int, opening_plies : int, labels : bool, generator : str, book : Union[str, None] = None,
+        tablebases : Union[str, None] = None) -> tuple[int, int, int, dict]:
+    # spawned workers don't inherit the parent's backend, book or tablebases
+    Game.set_move_generator(generator)
+    Game.set_book(book)
+    Game.set_tablebases(tablebases)
+    path = os.path.join(out_dir, f"games-{shard:05d}.jsonl")
+    plies = 0
+    results = dict.fromkeys(RESULTS, 0)
+    with open(path, "w") as f:
+        for game_index in range(first_game, first_game + games):
+            game_seed = seed * 1000003 + game_index
+            white_agent = make_agent(white, game_seed)
+            black_agent = make_agent(black, game_seed + 1)
+            record = play_game(white_agent, black_agent, max_plies, opening_plies, game_seed, labels)
+            record["game"] = game_index
+            record["seed"] = game_seed
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            plies += len(record["moves"])
+            results[record["result"]] += 1
+    return shard, games, plies, results
+
+def run_selfplay(games : int, out_dir : str, white : str = "random", black : str = "random", workers : Union[int, None] = None,
+        seed : int = 0, games_per_shard : int = 50, max_plies : int = 400, opening_plies : int = 0, labels : bool = False,
+        generator : str = "bitboard", book : Union[str, None] = None,
+        tablebases : Union[str, None] = None) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    # shards no bigger than an even split, so that every worker gets some
+    # games; game seeds come from the game index, so the games are the same
+    games_per_shard = max(1, min(games_per_shard, math.ceil(games / workers)))
+    started = perf_counter()
+    totals = { "games": 0, "plies": 0, "results": dict.fromkeys(RESULTS, 0) }
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for shard, first_game in enumerate(range(0, games, games_per_shard)):
+            count = min(games_per_shard, games - first_game)
+            futures.append(executor.submit(play_shard, shard, first_game, count, out_dir, white, black, seed,
+                max_plies, opening_plies, labels, generator, book, tablebases))
+        for future in as_completed(futures):
+            shard, count, plies, results = future.result()
+            totals["games"] += count
+            totals["plies"] += plies
+            for result, number in results.items():
+                totals["results"][result] += number
+            elapsed = perf_counter() - started
+            print(f"shard {shard} done: {totals['games']}/{games} games, {totals['games'] / elapsed:.2f} games/s, {totals['plies'] / elapsed:.0f} plies/s")
+    totals["time"] = perf_counter() - started
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless batch self-play for generating game datasets.")
+    parser.add_argument('--games', type=int, default=100, help="Number of games to play.")
+    parser.add_argument('--out', default="selfplay", help="Directory for the sharded JSON lines output.")
+    parser.add_argument('--white', default="random", help="White agent: random, search:DEPTH, search:nodes=N or search:time=SECONDS.")
+    parser.add_argument('--black', default="random", help="Black agent, as for --white.")
+    parser.add_argument('--workers', type=int, help="Worker processes, defaults to the number of cores.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--games-per-shard', type=int, default=50, help="Most games per output file, fewer when needed to keep every worker busy.")
+    parser.add_argument('--max-plies', type=int, default=400)
+    parser.add_argument('--opening-plies', type=int, default=0, help="Random moves to play before the agents take over.")
+    parser.add_argument('--labels', action="store_true", help="Store every position with the game result and search scores.")
+    parser.add_argument('--generator', choices=["checker", "bitboard"], default="bitboard", help="Move generation backend.")
+    parser.add_argument('--book', help="Opening book for search agents to play from before searching.")
+    parser.add_argument('--tablebases', help="Directory of endgame tablebases for search agents to play and search from.")
+    args = parser.parse_args()
+
+    totals = run_selfplay(args.games, args.out, args.white, args.black, args.workers, args.seed,
+        args.games_per_shard, args.max_plies, args.opening_plies, args.labels, args.generator, args.book, args.tablebases)
+    print(f"{totals['games']} games, {totals['plies']} plies in {totals['time']:.2f}s: {totals['results']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import os
+import random
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Union
+
+from main import Game, Position, PIECE_ID, is_in_check, move_to_string, pack_move, string_to_move, unpack_move
+
+# line protocol, one command per line and one reply line per command, which
+# starts with "ok" or "error":
+#   new [FEN]            -> ok GAME
+#   move GAME E2 E4 [Q]  -> ok RESULT [REASON], RESULT being * while the game goes on
+#   legal GAME           -> ok MOVE,MOVE,...
+#   fen GAME             -> ok FEN
+#   resign GAME          -> ok RESULT resignation, the side to move resigns
+#   close GAME           -> ok, forgetting the game
+#   quit                 -> ok, closing the connection
+
+# worker side: this only gets a FEN so that nothing but a string crosses processes
+# returns what Game caches per ply, the legal moves and whether the side to move is in check
+def ply_state(fen : str) -> tuple[array, bool]:
+    position = Position.from_fen(fen)
+    black_to_move = position.black_to_move
+    return Game.generate_legal_moves(position, black_to_move), is_in_check(position, black_to_move)
+
+class ServerGame:
+    __slots__ = ("game", "lock", "result", "reason")
+
+    def __init__(self, fen : Union[str, None] = None):
+        self.game = Game(verbose=False, fen=fen)
+        # moves on one game are applied one at a time, even across connections
+        self.lock = asyncio.Lock()
+        self.result = "*"
+        self.reason = ""
+
+class GameServer:
+    # workers is the size of the process pool for move generation, 0 runs it
+    # inline on the event loop
+    def __init__(self, workers : Union[int, None] = None, generator : str = "bitboard"):
+        Game.set_move_generator(generator)
+        self.games = dict()
+        self.next_id = 1
+        self.moves = 0
+        self.executor = None
+        if workers != 0:
+            self.executor = ProcessPoolExecutor(workers, initializer=Game.set_move_generator, initargs=(generator,))
+        self.commands = {
+            "new": self.new_game,
+            "move": self.move,
+            "legal": self.legal,
+            "fen": self.fen,
+            "resign": self.resign,
+            "close": self.close,
+        }
+
+    async def offload(self, func, *args):
+        if self.executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def find_game(self, words : list[str]) -> ServerGame:
+        if len(words) < 2 or not words[1].isdigit() or int(words[1]) not in self.games:
+            raise ValueError("unknown game")
+        return self.games[int(words[1])]
+
+    async def new_game(self, words : list[str]) -> str:
+        fen = " ".join(words[1:]) or None
+        if fen is not None:
+            Position.from_fen(fen)
+        game_id = self.next_id
+        self.next_id += 1
+        self.games[game_id] = ServerGame(fen)
+        return f"ok {game_id}"
+
+    # fills the game's per ply cache, generating the moves off the loop
+    # callers hold the game's lock so that the moves can't go stale on the way
+    async def refresh(self, server_game : ServerGame):
+        game = server_game.game
+        if game.ply_moves is None:
+            moves, check = await self.offload(ply_state, game.to_fen())
+            game.cache_ply(moves, check)
+
+    async def move(self, words : list[str]) -> str:
+        server_game = self.find_game(words)
+        start, end, promotion = unpack_move(string_to_move(" ".join(words[2:])))
+        # moves over the protocol never prompt, an unnamed promotion is a queen
+        move = pack_move(start, end, promotion or PIECE_ID.queen)
+        async with server_game.lock:
+            if server_game.result != "*":
+                raise ValueError("game over")
+            game = server_game.game
+            await self.refresh(server_game)
+            if not game.try_move(move):
+                raise ValueError("illegal move")
+            self.moves += 1
+            # the next ply's moves tell whether the game is over, and make the
+            # next move or legal request on this game a lookup
+            await self.refresh(server_game)
+            status = game.status()
+            if status == "checkmate":
+                server_game.result, server_game.reason = ("0-1" if not game.black_to_move else "1-0"), status
+            elif status:
+                server_game.result, server_game.reason = "1/2-1/2", status
+            elif game.current_position.halfmove_clock >= 100:
+                server_game.result, server_game.reason = "1/2-1/2", "fifty moves"
+        return f"ok {server_game.result} {server_game.reason}".rstrip()
+
+    async def legal(self, words : list[str]) -> str:
+        server_game = self.find_game(words)
+        async with server_game.lock:
+            if server_game.result != "*":
+                return "ok"
+            await self.refresh(server_game)
+            return "ok " + ",".join(move_to_string(move) for move in server_game.game.legal_moves())
+
+    async def fen(self, words : list[str]) -> str:
+        return "ok " + self.find_game(words).game.to_fen()
+
+    async def resign(self, words : list[str]) -> str:
+        server_game = self.find_game(words)
+        async with server_game.lock:
+            if server_game.result != "*":
+                raise ValueError("game over")
+            server_game.result = "1-0" if server_game.game.black_to_move else "0-1"
+            server_game.reason = "resignation"
+        return f"ok {server_game.result} {server_game.reason}"
+
+    async def close(self, words : list[str]) -> str:
+        self.find_game(words)
+        del self.games[int(words[1])]
+        return "ok"
+
+    async def command(self, line : str) -> str:
+        words = line.split()
+        if not words:
+            return "error empty command"
+        handler = self.commands.get(words[0].lower())
+        if handler is None:
+            return f"error unknown command {words[0]}"
+        try:
+            return await handler(words)
+        except ValueError as error:
+            return f"error {str(error).rstrip('.')}"
+
+    async def handle(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode().strip()
+                if text.lower() == "quit":
+                    writer.write(b"ok\n")
+                    break
+                writer.write((await self.command(text) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host : str = "127.0.0.1", port : int = 7777, unix : Union[str, None] = None):
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle, unix)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+async def open_connection(host : str, port : int, unix : Union[str, None]):
+    if unix is not None:
+        return await asyncio.open_unix_connection(unix)
+    return await asyncio.open_connection(host, port)
+
+# one load generator client: plays random games over its own connection and
+# records the round trip time of every move
+async def load_client(host : str, port : int, unix : Union[str, None], games : int, max_plies : int, seed : int, latencies : list[float]):
+    rng = random.Random(seed)
+    reader, writer = await open_connection(host, port, unix)
+
+    async def request(line : str) -> str:
+        writer.write((line + "\n").encode())
+        await writer.drain()
+        return (await reader.readline()).decode().strip()
+
+    for _ in range(games):
+        game_id = (await request("new")).split()[1]
+        for _ in range(max_plies):
+            moves = (await request(f"legal {game_id}"))[3:]
+            if not moves:
+                break
+            started = perf_counter()
+            reply = await request(f"move {game_id} {rng.choice(moves.split(','))}")
+            latencies.append(perf_counter() - started)
+            if not reply.startswith("ok *"):
+                break
+        await request(f"close {game_id}")
+    writer.write(b"quit\n")
+    await writer.drain()
+    writer.close()
+
+async def run_load(host : str, port : int, unix : Union[str, None], clients : int, games : int, max_plies : int) -> dict:
+    latencies = []
+    started = perf_counter()
+    await asyncio.gather(*(load_client(host, port, unix, games, max_plies, seed, latencies) for seed in range(clients)))
+    elapsed = perf_counter() - started
+    latencies.sort()
+    count = len(latencies)
+    return {
+        "moves": count,
+        "time": elapsed,
+        "moves_per_second": count / elapsed if elapsed > 0 else 0,
+        "p50": latencies[count // 2] if count else 0,
+        "p99": latencies[min(count * 99 // 100, count - 1)] if count else 0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-game server over a line protocol, and a load generator for it.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--unix', help="Unix socket path to use instead of TCP.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Run the server.")
+    serve.add_argument('--workers', type=int, help="Move generation worker processes, 0 to run on the event loop. Defaults to the number of cores.")
+    serve.add_argument('--generator', choices=["checker", "bitboard"], default="bitboard", help="Move generation backend.")
+    load = commands.add_parser("load", help="Play random games against a running server and report throughput.")
+    load.add_argument('--clients', type=int, default=16, help="Concurrent connections.")
+    load.add_argument('--games', type=int, default=4, help="Games per client.")
+    load.add_argument('--max-plies', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = GameServer(args.workers if args.workers is not None else os.cpu_count(), args.generator)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+        return
+
+    stats = asyncio.run(run_load(args.host, args.port, args.unix, args.clients, args.games, args.max_plies))
+    print(f"{stats['moves']} moves in {stats['time']:.2f}s: {stats['moves_per_second']:.0f} moves/s,"
+        f" p50 {stats['p50'] * 1e3:.2f}ms, p99 {stats['p99'] * 1e3:.2f}ms")
+
+if __name__ == "__main__":
+    main()
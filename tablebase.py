@@ -0,0 +1,433 @@
+import argparse
+import mmap
+import os
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Union
+
+from main import (
+    Game, Position, PIECE_ID, PIECE_LETTERS, KIND_MASK, BLACK_BIT, KING_SQUARES,
+    pack_piece, unpack_move, is_in_check
+)
+
+# a table holds one byte per index for a material signature such as KQK (white
+# pieces, then black pieces, kings first): DRAW, BROKEN for placements that
+# can't happen, or 1 + the distance to mate in plies from the side to move's
+# point of view, so odd distances are wins and even ones are losses
+TB_MAGIC = b"PYTB"
+TB_VERSION = 1
+TB_HEADER = struct.Struct("<4sHH8s")
+TB_SUFFIX = ".pctb"
+DRAW = 0
+BROKEN = 255
+MAX_DISTANCE = BROKEN - 2
+# material values used to decide which side a signature puts first
+STRENGTH = { "K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1 }
+
+# square maps for the eight symmetries of the board: bit 0 mirrors the files,
+# bit 1 mirrors the ranks and bit 2 swaps ranks and files
+def build_transform(symmetry : int) -> list[int]:
+    squares = []
+    for square in range(64):
+        rank, file = square >> 3, square & 7
+        if symmetry & 1:
+            file = 7 - file
+        if symmetry & 2:
+            rank = 7 - rank
+        if symmetry & 4:
+            rank, file = file, rank
+        squares.append(rank * 8 + file)
+    return squares
+
+TRANSFORMS = [build_transform(symmetry) for symmetry in range(8)]
+
+# with pawns only the files can be mirrored, which leaves the white king on the
+# a-d files; without pawns it can be brought into the a1-d1-d4 triangle
+PAWN_KING_SQUARES = [square for square in range(64) if square & 7 < 4]
+PAWNLESS_KING_SQUARES = [square for square in range(64) if square >> 3 <= square & 7 < 4]
+
+def king_symmetry(king : int, pawns : bool) -> int:
+    rank, file = king >> 3, king & 7
+    symmetry = 0
+    if file > 3:
+        symmetry |= 1
+        file = 7 - file
+    if pawns:
+        return symmetry
+    if rank > 3:
+        symmetry |= 2
+        rank = 7 - rank
+    if rank > file:
+        symmetry |= 4
+    return symmetry
+
+def split_material(material : str) -> tuple[str, str]:
+    black_king = material.find("K", 1)
+    if not material.startswith("K") or black_king == -1:
+        raise ValueError(f"Invalid material {material}, expected something like KQK.")
+    return material[:black_king], material[black_king:]
+
+def side_letters(squares : bytearray, is_black : bool) -> str:
+    team_bit = BLACK_BIT if is_black else 0
+    codes = sorted((code & KIND_MASK) - 1 for code in squares if code and (code & BLACK_BIT) == team_bit)
+    return "".join(PIECE_LETTERS[piece_id] for piece_id in codes)
+
+# the signature a position is stored under, and whether the colours have to be
+# swapped to get there: the side with more material always comes first
+def material_signature(squares : bytearray) -> tuple[str, bool]:
+    white = side_letters(squares, False)
+    black = side_letters(squares, True)
+    white_strength = sum(STRENGTH[letter] for letter in white)
+    black_strength = sum(STRENGTH[letter] for letter in black)
+    if (white_strength, white) >= (black_strength, black):
+        return white + black, False
+    return black + white, True
+
+# kings alone, or with a single minor piece between them, can't mate
+def is_insufficient(material : str) -> bool:
+    rest = material.replace("K", "")
+    return rest in ("", "B", "N")
+
+class TableLayout:
+    # maps placements of the pieces in a signature to table indexes and back
+    # a placement lists the squares of the white king, the other white pieces,
+    # the black king and the other black pieces, in signature order
+    def __init__(self, material : str):
+        white, black = split_material(material)
+        self.material = material
+        self.pieces = [(PIECE_ID(PIECE_LETTERS.index(letter)), False) for letter in white] \
+            + [(PIECE_ID(PIECE_LETTERS.index(letter)), True) for letter in black]
+        self.pawns = "P" in material
+        self.king_squares = PAWN_KING_SQUARES if self.pawns else PAWNLESS_KING_SQUARES
+        self.king_index = { square: index for index, square in enumerate(self.king_squares) }
+        self.per_king = 64 ** (len(self.pieces) - 1) * 2
+        self.size = len(self.king_squares) * self.per_king
+
+    def index(self, placement : list[int], black_to_move : bool) -> int:
+        transform = TRANSFORMS[king_symmetry(placement[0], self.pawns)]
+        index = self.king_index[transform[placement[0]]]
+        for square in placement[1:]:
+            index = index * 64 + transform[square]
+        return index * 2 + black_to_move
+
+    def decode(self, index : int) -> tuple[list[int], bool]:
+        black_to_move = bool(index & 1)
+        index >>= 1
+        placement = []
+        for _ in range(len(self.pieces) - 1):
+            placement.append(index & 63)
+            index >>= 6
+        placement.append(self.king_squares[index])
+        placement.reverse()
+        return placement, black_to_move
+
+    # the squares of a position's pieces in signature order; flipped swaps the
+    # colours and mirrors the ranks so that the stronger side plays white
+    def placement(self, squares : bytearray, flipped : bool = False) -> list[int]:
+        placement = []
+        used = set()
+        for piece_id, is_black in self.pieces:
+            code = pack_piece(piece_id, is_black != flipped)
+            for square, square_code in enumerate(squares):
+                if square not in used and (square_code & 0x0F) == code:
+                    used.add(square)
+                    placement.append(square ^ 56 if flipped else square)
+                    break
+        return placement
+
+    # the position for an index, or None when the pieces can't stand like that
+    def position(self, index : int) -> Union[Position, None]:
+        placement, black_to_move = self.decode(index)
+        if len(set(placement)) != len(placement):
+            return None
+        squares = bytearray(64)
+        for (piece_id, is_black), square in zip(self.pieces, placement):
+            if piece_id == PIECE_ID.pawn and square >> 3 in (0, 7):
+                return None
+            squares[square] = pack_piece(piece_id, is_black)
+        white_king = placement[0]
+        black_king = placement[len(split_material(self.material)[0])]
+        if black_king in KING_SQUARES[white_king]:
+            return None
+        position = Position.from_state(squares, black_to_move, 0)
+        # the side that just moved can't have left its king in check
+        if is_in_check(position, not black_to_move):
+            return None
+        return position
+
+class Tablebases:
+    # opens tables from a directory on demand, through mmap
+    def __init__(self, directory : str):
+        self.directory = directory
+        self.tables = dict()
+        self.max_pieces = 0
+        for name in os.listdir(directory) if os.path.isdir(directory) else ():
+            if name.endswith(TB_SUFFIX):
+                self.max_pieces = max(self.max_pieces, len(name) - len(TB_SUFFIX))
+
+    def table(self, material : str):
+        if material not in self.tables:
+            path = os.path.join(self.directory, material + TB_SUFFIX)
+            if not os.path.exists(path):
+                self.tables[material] = None
+            else:
+                with open(path, "rb") as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, _, stored = TB_HEADER.unpack_from(data, 0)
+                if magic != TB_MAGIC or version != TB_VERSION or stored.rstrip(b"\0").decode() != material:
+                    raise ValueError(f"{path} is not a tablebase for {material}.")
+                self.tables[material] = (TableLayout(material), data)
+        return self.tables[material]
+
+    # the stored byte for the position, DRAW for dead positions or None when
+    # there's no table for its material
+    def probe_value(self, position : Position) -> Union[int, None]:
+        squares = position.squares
+        if 64 - squares.count(0) > max(self.max_pieces, 3):
+            return None
+        material, flipped = material_signature(squares)
+        if is_insufficient(material):
+            return DRAW
+        table = self.table(material)
+        if table is None:
+            return None
+        layout, data = table
+        index = layout.index(layout.placement(squares, flipped), position.black_to_move != flipped)
+        return data[TB_HEADER.size + index]
+
+    # (result, plies) for the side to move, result being 1 for a win, 0 for a
+    # draw and -1 for a loss, or None when the position isn't covered
+    def probe(self, position : Position) -> Union[tuple[int, int], None]:
+        value = self.probe_value(position)
+        if value is None or value == BROKEN:
+            return None
+        if value == DRAW:
+            return 0, 0
+        distance = value - 1
+        return (1 if distance & 1 else -1), distance
+
+    # the move that wins fastest, holds the draw or loses slowest, or 0 when
+    # the position isn't covered
+    def best_move(self, position : Position) -> int:
+        if self.probe(position) is None:
+            return 0
+        best, best_rank = 0, None
+        for move in Game.generate_legal_moves(position, position.black_to_move):
+            start, end, promotion = unpack_move(move)
+            position.make_move(start, end, promotion or PIECE_ID.queen)
+            child = self.probe(position)
+            position.unmake_move()
+            if child is None:
+                continue
+            result, plies = child
+            # rank from our side: their loss is our win, quickest first
+            rank = (1, -plies) if result < 0 else (0, 0) if result == 0 else (-1, plies)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = move, rank
+        return best
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+        self.tables.clear()
+
+# worker state for generate_block
+worker_layout = None
+worker_tablebases = None
+
+def init_worker(material : str, directory : str, generator : str):
+    global worker_layout, worker_tablebases
+    Game.set_move_generator(generator)
+    worker_layout = TableLayout(material)
+    worker_tablebases = Tablebases(directory)
+
+# generates the moves of every index for one king square
+# returns the first index, a state per index (0 broken, 1 legal, 2 mated),
+# move counts, and the children of every move: table indexes, or -1 - value
+# for moves that capture or promote into another table
+def generate_block(king : int) -> tuple[int, bytes, array, array]:
+    layout = worker_layout
+    first = king * layout.per_king
+    states = bytearray(layout.per_king)
+    counts = array('H', bytes(2 * layout.per_king))
+    children = array('q')
+    piece_count = len(layout.pieces)
+    for offset in range(layout.per_king):
+        position = layout.position(first + offset)
+        if position is None:
+            continue
+        black_to_move = position.black_to_move
+        moves = Game.generate_legal_moves(position, black_to_move)
+        if not len(moves):
+            states[offset] = 2 if is_in_check(position, black_to_move) else 1
+            continue
+        states[offset] = 1
+        counts[offset] = len(moves)
+        for move in moves:
+            start, end, promotion = unpack_move(move)
+            promoting = (position.squares[start] & KIND_MASK) - 1 == PIECE_ID.pawn and end >> 3 in (0, 7)
+            position.make_move(start, end, promotion or PIECE_ID.queen)
+            if 64 - position.squares.count(0) == piece_count and not promoting:
+                children.append(layout.index(layout.placement(position.squares), position.black_to_move))
+            else:
+                value = worker_tablebases.probe_value(position)
+                if value is None:
+                    raise ValueError(f"Missing tablebase for {material_signature(position.squares)[0]}.")
+                children.append(-1 - value)
+            position.unmake_move()
+    return first, bytes(states), counts, children
+
+# the signatures reachable by one capture or promotion
+def sub_materials(material : str) -> set[str]:
+    white, black = split_material(material)
+    found = set()
+    for side, other, is_white in ((white, black, True), (black, white, False)):
+        for at, letter in enumerate(side):
+            if letter == "K":
+                continue
+            replacements = [""] + (["Q", "R", "B", "N"] if letter == "P" else [])
+            for replacement in replacements:
+                letters = "".join(sorted(side[:at] + replacement + side[at + 1:], key=PIECE_LETTERS.index))
+                squares_white, squares_black = (letters, other) if is_white else (other, letters)
+                found.add(canonical_material(squares_white, squares_black))
+    return found
+
+def canonical_material(white : str, black : str) -> str:
+    white_strength = sum(STRENGTH[letter] for letter in white)
+    black_strength = sum(STRENGTH[letter] for letter in black)
+    if (white_strength, white) >= (black_strength, black):
+        return white + black
+    return black + white
+
+# resolves every position by retrograde analysis: starting from the mates,
+# a position with a lost child is won one ply later, and a position whose
+# children are all won is lost one ply after the last of them
+def solve(layout : TableLayout, blocks : list[tuple[int, bytes, array, array]]) -> bytearray:
+    size = layout.size
+    values = bytearray([BROKEN]) * size
+    remaining = array('H', bytes(2 * size))
+    escapes = bytearray(size)
+    parents = dict()
+    current = []
+    pending_wins = dict()
+    pending_losses = dict()
+    for first, states, counts, children in blocks:
+        child = 0
+        for offset, state in enumerate(states):
+            if not state:
+                continue
+            index = first + offset
+            values[index] = DRAW
+            if state == 2:
+                values[index] = 1
+                current.append(index)
+                continue
+            remaining[index] = counts[offset]
+            for code in children[child:child + counts[offset]]:
+                if code >= 0:
+                    parents.setdefault(code, []).append(index)
+                    continue
+                value = -1 - code
+                if value == DRAW:
+                    escapes[index] = 1
+                elif (value - 1) & 1:
+                    # the child wins for the side to move there
+                    pending_losses.setdefault(value - 1, []).append(index)
+                else:
+                    pending_wins.setdefault(value, []).append(index)
+            child += counts[offset]
+
+    level = 0
+    while current or any(key >= level for key in pending_wins) or any(key >= level for key in pending_losses):
+        following = []
+        # children outside the table that win at this level
+        for index in pending_losses.pop(level, ()):
+            if values[index] == DRAW:
+                remaining[index] -= 1
+                if not remaining[index] and not escapes[index]:
+                    values[index] = level + 2
+                    following.append(index)
+        for index in current:
+            lost = not level & 1
+            for parent in parents.get(index, ()):
+                if values[parent] != DRAW:
+                    continue
+                if lost:
+                    values[parent] = level + 2
+                    following.append(parent)
+                else:
+                    remaining[parent] -= 1
+                    if not remaining[parent] and not escapes[parent]:
+                        values[parent] = level + 2
+                        following.append(parent)
+        level += 1
+        if level > MAX_DISTANCE:
+            break
+        # children outside the table that were lost one ply ago
+        for index in pending_wins.pop(level, ()):
+            if values[index] == DRAW:
+                values[index] = level + 1
+                following.append(index)
+        current = following
+    return values
+
+def generate(material : str, directory : str, workers : Union[int, None] = None, generator : str = "bitboard",
+        verbose : bool = True) -> str:
+    white, black = split_material(material)
+    material = canonical_material(white, black)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, material + TB_SUFFIX)
+    for sub_material in sorted(sub_materials(material)):
+        if not is_insufficient(sub_material) and not os.path.exists(os.path.join(directory, sub_material + TB_SUFFIX)):
+            generate(sub_material, directory, workers, generator, verbose)
+
+    started = perf_counter()
+    layout = TableLayout(material)
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(material, directory, generator)) as executor:
+        blocks = list(executor.map(generate_block, range(len(layout.king_squares))))
+    values = solve(layout, blocks)
+    with open(path, "wb") as f:
+        f.write(TB_HEADER.pack(TB_MAGIC, TB_VERSION, 0, material.encode()))
+        f.write(values)
+    if verbose:
+        decisive = [value - 1 for value in values if value not in (DRAW, BROKEN)]
+        longest = max((distance for distance in decisive if distance & 1), default=0)
+        print(f"{material}: {layout.size} indexes, {sum(1 for value in values if value != BROKEN)} legal,"
+            f" longest win {(longest + 1) // 2} moves, {perf_counter() - started:.1f}s")
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate and probe distance to mate endgame tablebases.")
+    parser.add_argument('--dir', default="tablebases", help="Directory holding the tables.")
+    parser.add_argument('--generator', choices=["checker", "bitboard"], default="bitboard", help="Move generation backend.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="Generate tables, along with any they depend on.")
+    build.add_argument('materials', nargs="+", help="Signatures such as KQK, KRK or KPK.")
+    build.add_argument('--workers', type=int, help="Worker processes, defaults to the number of cores.")
+    probe = commands.add_parser("probe", help="Look up a position.")
+    probe.add_argument('fen')
+    args = parser.parse_args()
+
+    Game.set_move_generator(args.generator)
+    if args.command == "generate":
+        for material in args.materials:
+            generate(material.upper(), args.dir, args.workers, args.generator)
+        return
+
+    tablebases = Tablebases(args.dir)
+    position = Position.from_fen(args.fen)
+    entry = tablebases.probe(position)
+    if entry is None:
+        print("Not in the tablebases.")
+        return
+    result, plies = entry
+    from main import move_to_string
+    move = tablebases.best_move(position)
+    outcome = "draw" if result == 0 else f"{'win' if result > 0 else 'loss'} in {plies} plies"
+    print(f"{outcome}, best move {move_to_string(move) if move else 'none'}")
+
+if __name__ == "__main__":
+    main()
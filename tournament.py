@@ -0,0 +1,211 @@
+import argparse
+import math
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from time import perf_counter
+from typing import Union
+
+from main import Game
+from agents import make_agent
+from selfplay import play_game
+
+# points for the first agent by result, when it plays white
+WHITE_POINTS = { "1-0": 1.0, "1/2-1/2": 0.5, "0-1": 0.0 }
+# normal quantile for 95% confidence intervals
+CONFIDENCE_Z = 1.959964
+
+class TimedAgent:
+    # wraps an agent to count its moves, thinking time and search nodes
+    # last_result passes through so that play_game can still label positions
+    def __init__(self, agent):
+        self.agent = agent
+        self.moves = 0
+        self.time = 0.0
+        self.nodes = 0
+
+    @property
+    def last_result(self):
+        return getattr(self.agent, "last_result", None)
+
+    def __call__(self, position, black_to_move : bool) -> int:
+        started = perf_counter()
+        move = self.agent(position, black_to_move)
+        self.time += perf_counter() - started
+        self.moves += 1
+        if self.last_result is not None:
+            self.nodes += self.last_result.nodes
+        return move
+
+# agents are specs for make_agent, or any picklable agent callable
+def build_agent(agent, seed : int):
+    return make_agent(agent, seed) if isinstance(agent, str) else agent
+
+def init_worker(generator : str, book : Union[str, None], tablebases : Union[str, None]):
+    Game.set_move_generator(generator)
+    Game.set_book(book)
+    Game.set_tablebases(tablebases)
+
+# worker entry point: plays one opening twice, the first agent taking white and
+# then black, and returns the first agent's points in each game along with
+# [moves, time, nodes] for both agents
+def play_pair(pair : int, first, second, seed : int, max_plies : int, opening_plies : int) -> tuple[int, list[float], list[list]]:
+    game_seed = seed * 1000003 + pair
+    agents = [TimedAgent(build_agent(first, game_seed)), TimedAgent(build_agent(second, game_seed + 1))]
+    points = []
+    # the same seed plays the same random opening both times
+    record = play_game(agents[0], agents[1], max_plies, opening_plies, game_seed)
+    points.append(WHITE_POINTS[record["result"]])
+    record = play_game(agents[1], agents[0], max_plies, opening_plies, game_seed)
+    points.append(1.0 - WHITE_POINTS[record["result"]])
+    return pair, points, [[agent.moves, agent.time, agent.nodes] for agent in agents]
+
+def expected_score(elo : float) -> float:
+    return 1 / (1 + 10 ** (-elo / 400))
+
+def score_to_elo(score : float) -> float:
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+# elo difference of the first agent and its 95% confidence interval, from the
+# score and its per game variance
+def elo_interval(points : list[float]) -> tuple[float, float, float]:
+    count = len(points)
+    if not count:
+        return 0.0, -math.inf, math.inf
+    score = sum(points) / count
+    variance = sum((point - score) ** 2 for point in points) / count
+    margin = CONFIDENCE_Z * math.sqrt(variance / count)
+    return score_to_elo(score), score_to_elo(score - margin), score_to_elo(score + margin)
+
+# log likelihood ratio of elo1 against elo0, using the normal approximation
+# to the score distribution
+def sprt_llr(points : list[float], elo0 : float, elo1 : float) -> float:
+    count = len(points)
+    if count < 2:
+        return 0.0
+    score = sum(points) / count
+    variance = sum((point - score) ** 2 for point in points) / count
+    if variance <= 0:
+        return 0.0
+    score0, score1 = expected_score(elo0), expected_score(elo1)
+    return count * ((score - score0) ** 2 - (score - score1) ** 2) / (2 * variance)
+
+def sprt_bounds(alpha : float, beta : float) -> tuple[float, float]:
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+# plays up to pairs colour swapped game pairs between the two agents across
+# worker processes; with sprt given as (elo0, elo1, alpha, beta) the match
+# stops as soon as the log likelihood ratio leaves its bounds
+# on_pair is called with the running report after every finished pair
+def run_tournament(first, second, pairs : int = 50, workers : Union[int, None] = None, seed : int = 0,
+        max_plies : int = 300, opening_plies : int = 8, generator : str = "bitboard", book : Union[str, None] = None,
+        tablebases : Union[str, None] = None, sprt : Union[tuple[float, float, float, float], None] = None,
+        on_pair = None) -> dict:
+    workers = workers or os.cpu_count() or 1
+    points = []
+    stats = [[0, 0.0, 0] for _ in range(2)]
+    verdict = None
+    started = perf_counter()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(generator, book, tablebases)) as executor:
+        # only a couple of pairs per worker in flight, so that stopping early wastes little
+        pending = set()
+        next_pair = 0
+        while pending or next_pair < pairs:
+            while next_pair < pairs and len(pending) < workers * 2:
+                pending.add(executor.submit(play_pair, next_pair, first, second, seed, max_plies, opening_plies))
+                next_pair += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                _, pair_points, pair_stats = future.result()
+                points.extend(pair_points)
+                for total, agent in zip(stats, pair_stats):
+                    for field, value in enumerate(agent):
+                        total[field] += value
+                if sprt is not None:
+                    lower, upper = sprt_bounds(sprt[2], sprt[3])
+                    llr = sprt_llr(points, sprt[0], sprt[1])
+                    if llr <= lower:
+                        verdict = "H0"
+                    elif llr >= upper:
+                        verdict = "H1"
+                if on_pair is not None:
+                    on_pair(tournament_report(points, stats, perf_counter() - started, sprt, verdict))
+                if verdict is not None:
+                    break
+            if verdict is not None:
+                break
+        elapsed = perf_counter() - started
+        # pairs already running can't be stopped, but whatever they finish
+        # after the verdict is left out so the report matches the decision
+        executor.shutdown(cancel_futures=True)
+    return tournament_report(points, stats, elapsed, sprt, verdict)
+
+def tournament_report(points : list[float], stats : list[list], elapsed : float,
+        sprt : Union[tuple[float, float, float, float], None], verdict : Union[str, None]) -> dict:
+    elo, elo_low, elo_high = elo_interval(points)
+    report = {
+        "games": len(points),
+        "wins": points.count(1.0),
+        "draws": points.count(0.5),
+        "losses": points.count(0.0),
+        "score": sum(points) / len(points) if points else 0.0,
+        "elo": elo,
+        "elo_low": elo_low,
+        "elo_high": elo_high,
+        "time": elapsed,
+        "games_per_second": len(points) / elapsed if elapsed > 0 else 0.0,
+        "agents": [{
+            "moves": moves,
+            "ms_per_move": time / moves * 1e3 if moves else 0.0,
+            "nps": nodes / time if time > 0 else 0.0,
+        } for moves, time, nodes in stats],
+    }
+    if sprt is not None:
+        report["llr"] = sprt_llr(points, sprt[0], sprt[1])
+        report["llr_bounds"] = sprt_bounds(sprt[2], sprt[3])
+        report["verdict"] = verdict
+    return report
+
+def format_elo(elo : float) -> str:
+    return f"{elo:+.1f}" if math.isfinite(elo) else ("+inf" if elo > 0 else "-inf")
+
+def main():
+    parser = argparse.ArgumentParser(description="Play two agents against each other and estimate their Elo difference.")
+    parser.add_argument('first', help="First agent: random, search:DEPTH, search:nodes=N or search:time=SECONDS, with ,eval=pst or ,eval=material.")
+    parser.add_argument('second', help="Second agent, as for the first.")
+    parser.add_argument('--pairs', type=int, default=50, help="Maximum number of colour swapped game pairs.")
+    parser.add_argument('--workers', type=int, help="Worker processes, defaults to the number of cores.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-plies', type=int, default=300)
+    parser.add_argument('--opening-plies', type=int, default=8, help="Random moves played before the agents take over.")
+    parser.add_argument('--generator', choices=["checker", "bitboard"], default="bitboard", help="Move generation backend.")
+    parser.add_argument('--book', help="Opening book for search agents to play from before searching.")
+    parser.add_argument('--tablebases', help="Directory of endgame tablebases for search agents to play and search from.")
+    parser.add_argument('--sprt', nargs=2, type=float, metavar=("ELO0", "ELO1"), help="Stop early once the first agent is shown to be ELO0 or ELO1 stronger.")
+    parser.add_argument('--alpha', type=float, default=0.05, help="SPRT false positive rate.")
+    parser.add_argument('--beta', type=float, default=0.05, help="SPRT false negative rate.")
+    args = parser.parse_args()
+
+    sprt = (args.sprt[0], args.sprt[1], args.alpha, args.beta) if args.sprt else None
+
+    def progress(report : dict):
+        line = f"{report['games']} games: +{report['wins']} ={report['draws']} -{report['losses']}, elo {format_elo(report['elo'])}"
+        if sprt is not None:
+            line += f", llr {report['llr']:.2f} ({report['llr_bounds'][0]:.2f}, {report['llr_bounds'][1]:.2f})"
+        print(line)
+
+    report = run_tournament(args.first, args.second, args.pairs, args.workers, args.seed, args.max_plies, args.opening_plies,
+        args.generator, args.book, args.tablebases, sprt, progress)
+    print(f"{args.first} vs {args.second}: {report['games']} games in {report['time']:.1f}s ({report['games_per_second']:.2f} games/s)")
+    print(f"score {report['score']:.3f}, elo {format_elo(report['elo'])} [{format_elo(report['elo_low'])}, {format_elo(report['elo_high'])}]")
+    for name, agent in zip((args.first, args.second), report["agents"]):
+        print(f"{name}: {agent['moves']} moves, {agent['ms_per_move']:.2f} ms/move, {agent['nps']:.0f} nodes/s")
+    if sprt is not None:
+        verdict = { "H0": f"H0 accepted, not {args.sprt[1]:g} elo stronger", "H1": f"H1 accepted, {args.sprt[1]:g} elo stronger" }
+        print(verdict.get(report["verdict"], "SPRT inconclusive"))
+
+if __name__ == "__main__":
+    main()
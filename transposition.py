@@ -0,0 +1,81 @@
+from enum import IntEnum
+from array import array
+from typing import Union
+
+class BOUND(IntEnum):
+    exact = 0
+    lower = 1
+    upper = 2
+
+class REPLACEMENT(IntEnum):
+    # keep the deeper entry unless the stored one is from an older search
+    depth_preferred = 0
+    always = 1
+
+class TranspositionTable:
+    # entries live in parallel fixed size arrays indexed by the low bits of the
+    # zobrist key, so the table never allocates after construction
+    # size is rounded down to a power of two
+    def __init__(self, size : int = 1 << 20, replacement : REPLACEMENT = REPLACEMENT.depth_preferred):
+        size = 1 << (max(size, 1).bit_length() - 1)
+        self.size = size
+        self.mask = size - 1
+        self.replacement = replacement
+        self.keys = array('Q', [0]) * size
+        self.moves = array('H', [0]) * size
+        self.scores = array('i', [0]) * size
+        # depth -1 marks an empty slot
+        self.depths = array('b', [-1]) * size
+        self.bounds = array('B', [0]) * size
+        self.ages = array('B', [0]) * size
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    # call at the start of each search so that stale entries get replaced first
+    def new_search(self):
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        self.keys = array('Q', [0]) * self.size
+        self.depths = array('b', [-1]) * self.size
+        self.age = 0
+        self.hits = self.misses = self.stores = self.evictions = 0
+
+    # returns (move, score, bound, depth) or None when the key isn't stored
+    def probe(self, key : int) -> Union[tuple[int, int, BOUND, int], None]:
+        index = key & self.mask
+        if self.depths[index] == -1 or self.keys[index] != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (self.moves[index], self.scores[index], self.bounds[index], self.depths[index])
+
+    def store(self, key : int, depth : int, score : int, bound : BOUND, move : int = 0):
+        index = key & self.mask
+        stored_depth = self.depths[index]
+        if stored_depth != -1:
+            same_key = self.keys[index] == key
+            if self.replacement == REPLACEMENT.depth_preferred and not same_key \
+                    and self.ages[index] == self.age and depth < stored_depth:
+                return
+            if not same_key:
+                self.evictions += 1
+            # keep the old best move if the new entry has none
+            elif move == 0:
+                move = self.moves[index]
+        self.keys[index] = key
+        self.depths[index] = min(depth, 127)
+        self.scores[index] = score
+        self.bounds[index] = bound
+        self.moves[index] = move
+        self.ages[index] = self.age
+        self.stores += 1
+
+    # permille of slots in use, as reported by UCI engines
+    def hashfull(self) -> int:
+        sample = min(self.size, 1000)
+        used = sum(1 for index in range(sample) if self.depths[index] != -1)
+        return used * 1000 // sample
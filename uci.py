@@ -0,0 +1,223 @@
+import sys
+import threading
+from time import perf_counter
+from typing import Union
+
+from main import Game, Position, PIECE_LETTERS, SQUARE_INDEX, SQUARE_NAMES, pack_move, unpack_move
+from replay import ReplayError, replay_game
+from search import MATE, MAX_PLY, Searcher, SearchResult, material_evaluation
+from transposition import TranspositionTable
+
+ENGINE_NAME = "PyChess"
+ENGINE_AUTHOR = "PyChess contributors"
+# bytes per transposition table entry, for turning the Hash option into a size
+ENTRY_BYTES = 17
+DEFAULT_HASH_MB = 16
+# time kept back for reading output and sending the move
+MOVE_OVERHEAD = 0.05
+# moves the remaining clock is spread over when the GUI doesn't say
+DEFAULT_MOVES_TO_GO = 30
+
+# UCI moves look like e2e4 or e7e8q
+def uci_to_move(text : str) -> int:
+    text = text.upper()
+    start, end = SQUARE_INDEX.get(text[0:2]), SQUARE_INDEX.get(text[2:4])
+    if len(text) not in (4, 5) or start is None or end is None:
+        raise ValueError(f"Invalid move {text.lower()}.")
+    promotion = 0
+    if len(text) == 5:
+        if text[4] not in PIECE_LETTERS[1:5]:
+            raise ValueError(f"Invalid promotion piece {text[4].lower()}.")
+        promotion = PIECE_LETTERS.index(text[4])
+    return pack_move(start, end, promotion)
+
+def move_to_uci(move : int) -> str:
+    if not move:
+        return "0000"
+    start, end, promotion = unpack_move(move)
+    text = (SQUARE_NAMES[start] + SQUARE_NAMES[end]).lower()
+    return text + PIECE_LETTERS[promotion].lower() if promotion else text
+
+def score_to_uci(score : int) -> str:
+    if abs(score) >= MATE - MAX_PLY:
+        plies = MATE - abs(score)
+        moves = (plies + 1) // 2
+        return f"mate {moves if score > 0 else -moves}"
+    return f"cp {score}"
+
+# seconds to spend on a move given the go parameters, or None to search until
+# told to stop
+def allocate_time(params : dict, black_to_move : bool) -> Union[float, None]:
+    if "movetime" in params:
+        return max(params["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+    clock = params.get("btime" if black_to_move else "wtime")
+    if clock is None:
+        return None
+    increment = params.get("binc" if black_to_move else "winc", 0) / 1000
+    clock /= 1000
+    moves_to_go = params.get("movestogo", DEFAULT_MOVES_TO_GO)
+    budget = clock / max(moves_to_go, 1) + increment * 0.75
+    # never risk more than half of what's left on the clock
+    return max(min(budget, clock / 2) - MOVE_OVERHEAD, 0.01)
+
+class UciEngine:
+    def __init__(self, output = sys.stdout, evaluate = material_evaluation):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.evaluate = evaluate
+        self.table = TranspositionTable(DEFAULT_HASH_MB * (1 << 20) // ENTRY_BYTES)
+        self.searcher = Searcher(evaluate, self.table)
+        self.game = Game(verbose=False)
+        self.position = self.game.current_position
+        self.thread = None
+        # set once the GUI allows a bestmove: immediately for timed searches,
+        # on stop or ponderhit for infinite and ponder searches
+        self.release = threading.Event()
+        self.ponder_time = None
+
+    def send(self, line : str):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    # returns False once the GUI has asked to quit
+    def handle(self, line : str) -> bool:
+        words = line.split()
+        if not words:
+            return True
+        command = words[0]
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max 4096")
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.set_option(words)
+        elif command == "ucinewgame":
+            self.stop()
+            self.table.clear()
+        elif command == "position":
+            self.stop()
+            self.set_position(words)
+        elif command == "go":
+            self.stop()
+            self.go(words)
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponderhit()
+        elif command == "quit":
+            self.stop()
+            return False
+        return True
+
+    def set_option(self, words : list[str]):
+        if "name" not in words or "value" not in words:
+            return
+        name = " ".join(words[words.index("name") + 1:words.index("value")]).lower()
+        value = " ".join(words[words.index("value") + 1:])
+        if name == "hash" and value.isdigit():
+            self.table = TranspositionTable(int(value) * (1 << 20) // ENTRY_BYTES)
+            self.searcher = Searcher(self.evaluate, self.table)
+
+    # position [startpos | fen FEN] [moves MOVE...]
+    # moves go through Game.check_move, the same as moves typed into the game
+    # a bad move is reported and the position is left after the moves before
+    # it, as --load does; a bad FEN leaves the previous position alone
+    def set_position(self, words : list[str]):
+        moves_at = words.index("moves") if "moves" in words else len(words)
+        fen = None
+        if len(words) > 1 and words[1] == "fen":
+            fen = " ".join(words[2:moves_at])
+            try:
+                Position.from_fen(fen)
+            except ValueError as error:
+                self.send(f"info string {error}")
+                return
+        moves = []
+        for text in words[moves_at + 1:]:
+            try:
+                moves.append(uci_to_move(text))
+            except ValueError as error:
+                self.send(f"info string Ply {len(moves) + 1}: {error}")
+                break
+        self.game.start_fen = fen
+        try:
+            for position in replay_game(self.game, moves):
+                self.position = position
+        except ReplayError as error:
+            self.send(f"info string {error}")
+            for position in replay_game(self.game, moves[:error.ply - 1]):
+                self.position = position
+
+    def go(self, words : list[str]):
+        params = dict()
+        flags = set()
+        index = 1
+        while index < len(words):
+            word = words[index]
+            if word in ("infinite", "ponder"):
+                flags.add(word)
+                index += 1
+            elif index + 1 < len(words) and words[index + 1].lstrip("-").isdigit():
+                params[word] = int(words[index + 1])
+                index += 2
+            else:
+                index += 1
+        time_limit = allocate_time(params, self.position.black_to_move)
+        # pondering searches on the opponent's time until ponderhit starts our clock
+        self.ponder_time = time_limit if "ponder" in flags else None
+        if flags:
+            time_limit = None
+            self.release.clear()
+        else:
+            self.release.set()
+        max_depth = params.get("depth", MAX_PLY)
+        node_limit = params.get("nodes")
+        self.thread = threading.Thread(target=self.search, args=(self.position, max_depth, time_limit, node_limit), daemon=True)
+        self.thread.start()
+
+    def search(self, position : Position, max_depth : int, time_limit : Union[float, None], node_limit : Union[int, None]):
+        result = self.searcher.search(position, max_depth, time_limit, node_limit, self.info)
+        best_move = result.best_move
+        if not best_move:
+            # stopped before the first iteration finished, any legal move beats none
+            moves = Game.generate_legal_moves(position, position.black_to_move)
+            best_move = moves[0] if len(moves) else 0
+        # an infinite or ponder search that finishes early still waits for the GUI
+        self.release.wait()
+        ponder = f" ponder {move_to_uci(result.pv[1])}" if len(result.pv) > 1 else ""
+        self.send(f"bestmove {move_to_uci(best_move)}{ponder}")
+
+    def info(self, result : SearchResult):
+        pv = " ".join(move_to_uci(move) for move in result.pv)
+        self.send(f"info depth {result.depth} score {score_to_uci(result.score)} nodes {result.nodes}"
+            f" nps {result.nps} time {int(result.time * 1000)} hashfull {self.table.hashfull()} pv {pv}")
+
+    def ponderhit(self):
+        if self.thread is None:
+            return
+        if self.ponder_time is not None:
+            self.searcher.deadline = perf_counter() + self.ponder_time
+        self.release.set()
+
+    # stops any running search and waits for its bestmove
+    def stop(self):
+        if self.thread is None:
+            return
+        self.release.set()
+        # the search clears its stop flag when it starts, so keep asking
+        while self.thread.is_alive():
+            self.searcher.stop()
+            self.thread.join(0.01)
+        self.thread = None
+
+def run_uci(input = sys.stdin, output = sys.stdout):
+    engine = UciEngine(output)
+    for line in input:
+        if not engine.handle(line.strip()):
+            break
+    engine.stop()